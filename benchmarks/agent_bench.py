@@ -0,0 +1,171 @@
+"""
+End-to-end benchmark of lambda_handler against local stand-ins.
+
+Drives synthetic Step Functions or SQS events through the real entry point, with
+DynamoDB, Salesforce, the chat model and (for --mcp y) the MCP server replaced by
+the fakes in benchmarks/fakes.py. Requires operator/requirements.txt installed.
+
+Reports p50/p95/p99 invocation latency, external calls per turn and checkpoint
+bytes written, so runs can be compared over time (see --out).
+
+Usage:
+    python benchmarks/agent_bench.py --mode sfn --mcp n --turns 50 --model-latency-ms 200
+    python benchmarks/agent_bench.py --mode sqs --batch-size 10 --profiles 5 --out bench.json
+    python benchmarks/agent_bench.py --mode sqs --batch-size 10 --profiles 5 --coalesce y
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+OPERATOR_DIR = os.path.join(BENCH_DIR, "..", "operator")
+sys.path.insert(0, BENCH_DIR)
+
+import fakes  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seed(dynamodb, profiles, instance_url):
+    users = dynamodb.Table("UserProfiles")
+    tokens = dynamodb.Table("salesforce_tokens")
+    userids = []
+    for i in range(profiles):
+        profile_id = f"profile-{i}"
+        userid = f"9190000{i:05d}"
+        users.items[(profile_id, userid)] = {"profile_id": profile_id, "userid": userid, "channel": "whatsapp"}
+        users.items[(profile_id, f"user{i}@example.com")] = {"profile_id": profile_id, "userid": f"user{i}@example.com", "channel": "email"}
+        tokens.items[(profile_id,)] = {"wa_id": profile_id, "access_token": f"token-{i}", "instance_url": instance_url, "refresh_token": f"refresh-{i}"}
+        userids.append(userid)
+    fakes.calls.clear()
+    return userids
+
+
+def sfn_event(userid):
+    return {
+        "taskToken": uuid.uuid4().hex,
+        "input": {"channel_type": "whatsapp", "from": userid, "message": "Show my open opportunities"},
+    }
+
+
+def sqs_event(userids, batch_size):
+    return {
+        "Records": [
+            {
+                "messageId": uuid.uuid4().hex,
+                "attributes": {"SentTimestamp": str(int(time.time() * 1000))},
+                "body": json.dumps({"channel_type": "whatsapp", "from": userids[i % len(userids)], "messages": "Show my open opportunities"}),
+            }
+            for i in range(batch_size)
+        ]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["sfn", "sqs"], default="sfn")
+    parser.add_argument("--mcp", choices=["y", "n"], default="n")
+    parser.add_argument("--turns", type=int, default=30, help="invocations to run (SQS: batches)")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--profiles", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--model-latency-ms", type=int, default=0)
+    parser.add_argument("--salesforce-latency-ms", type=int, default=0)
+    parser.add_argument("--coalesce", choices=["y", "n"], default="n", help="SQS: merge each sender's messages into one turn, under a profile lease")
+    parser.add_argument("--records", type=int, default=450, help="rows matched by the benchmark SOQL query")
+    parser.add_argument("--out", help="write the JSON summary to this file")
+    args = parser.parse_args()
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    salesforce = fakes.FakeSalesforce(record_count=args.records, latency_ms=args.salesforce_latency_ms).start()
+    mcp_server = fakes.FakeMCPServer(salesforce).start() if args.mcp == "y" else None
+
+    os.environ.update({
+        "USE_MCP": args.mcp,
+        "SF_DDB_TABLE": "salesforce_tokens",
+        "MODEL_NAME": "bench-model",
+        "PROVIDER_NAME": "bench",
+        "AWS_DEFAULT_REGION": "ap-south-1",
+    })
+    if args.coalesce == "y":
+        os.environ.update({"SQS_COALESCE": "y", "PROFILE_LOCK_TABLE": "profile_locks"})
+    if mcp_server:
+        os.environ["MCP_SERVER_URL"] = mcp_server.url
+
+    dynamodb = fakes.FakeDynamoDB()
+    fakes.install(dynamodb)
+    os.chdir(OPERATOR_DIR)
+    sys.path.insert(0, OPERATOR_DIR)
+
+    import app
+    import graph_shared
+    import outbound
+
+    outbound.set_dispatcher(outbound.InMemoryDispatcher())
+
+    model = fakes.ScriptedModel(latency_ms=args.model_latency_ms)
+    graph_shared.call_model = model
+
+    userids = seed(dynamodb, args.profiles, salesforce.url)
+
+    def invoke(i):
+        if args.mode == "sfn":
+            event = sfn_event(userids[i % len(userids)])
+        else:
+            event = sqs_event(userids, args.batch_size)
+        started = time.perf_counter()
+        result = app.lambda_handler(event, None)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if args.mode == "sqs" and result["batchItemFailures"]:
+            raise RuntimeError(f"Batch had failures: {result}")
+        return elapsed_ms
+
+    for i in range(args.warmup):
+        invoke(i)
+    fakes.calls.clear()
+    bytes_before = fakes.checkpoint_bytes_written()
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(args.turns):
+        latencies.append(invoke(i))
+    wall_s = time.perf_counter() - started
+
+    messages = args.turns * (args.batch_size if args.mode == "sqs" else 1)
+    calls = dict(sorted(fakes.calls.items()))
+    summary = {
+        "mode": args.mode,
+        "use_mcp": args.mcp,
+        "invocations": args.turns,
+        "messages": messages,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(statistics.mean(latencies), 2),
+        },
+        "messages_per_second": round(messages / wall_s, 2),
+        "external_calls_per_message": {key: round(count / messages, 2) for key, count in calls.items()},
+        "checkpoint_bytes_per_message": round((fakes.checkpoint_bytes_written() - bytes_before) / messages),
+    }
+
+    print(json.dumps(summary, indent=2))
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+
+    if mcp_server:
+        mcp_server.stop()
+    salesforce.stop()
+
+
+if __name__ == "__main__":
+    main()
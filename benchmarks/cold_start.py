@@ -0,0 +1,101 @@
+"""
+Measures Lambda cold-start cost locally.
+
+Each run starts a fresh interpreter in operator/ with `-X importtime`, imports the
+entry point and initializes the handler selected by USE_MCP without invoking it.
+For USE_MCP=n this compiles the graph, which constructs the DynamoDB checkpointer;
+its DescribeTable call is answered locally, so no AWS credentials are needed.
+
+Usage:
+    python benchmarks/cold_start.py --mcp n --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+OPERATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "operator")
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+import boto3
+from botocore.awsrequest import AWSResponse
+
+def describe_table(params, **kwargs):
+    # Short-circuits the checkpointer's table check before the request is signed or sent
+    return AWSResponse("", 200, {}, None), {"Table": {"TableName": json.loads(params["body"])["TableName"], "TableStatus": "ACTIVE"}}
+
+boto3._get_default_session().events.register("before-call.dynamodb.DescribeTable", describe_table)
+t1 = time.perf_counter()
+app.get_handler()
+t2 = time.perf_counter()
+print(json.dumps({"import_app_ms": (t1 - t0) * 1000, "first_handler_ms": (t2 - t1) * 1000}))
+"""
+
+
+def parse_importtime(stderr):
+    """Returns {module: cumulative_us} from `-X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [f.strip() for f in line[len("import time:"):].split("|")]
+        if len(fields) != 3 or not fields[1].isdigit():
+            continue
+        modules[fields[2].strip()] = int(fields[1])
+    return modules
+
+
+def run_once(use_mcp):
+    env = dict(os.environ, USE_MCP=use_mcp)
+    env.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=OPERATOR_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    timings = json.loads(proc.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mcp", choices=["y", "n"], default=os.getenv("USE_MCP", "n").lower())
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print a machine-readable summary")
+    args = parser.parse_args()
+
+    runs = [run_once(args.mcp) for _ in range(args.runs)]
+    summary = {
+        "use_mcp": args.mcp,
+        "runs": args.runs,
+        "import_app_ms": statistics.median(t["import_app_ms"] for t, _ in runs),
+        "first_handler_ms": statistics.median(t["first_handler_ms"] for t, _ in runs),
+    }
+    modules = {}
+    for _, importtime in runs:
+        for module, us in importtime.items():
+            modules.setdefault(module, []).append(us)
+    top = sorted(((statistics.median(v) / 1000, m) for m, v in modules.items()), reverse=True)[:args.top]
+    summary["top_imports_ms"] = {m: round(ms, 2) for ms, m in top}
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"USE_MCP={args.mcp}, median of {args.runs} runs")
+    print(f"  import app:          {summary['import_app_ms']:8.1f} ms")
+    print(f"  first handler ready: {summary['first_handler_ms']:8.1f} ms")
+    print(f"Top {args.top} imports by cumulative time:")
+    for module, ms in summary["top_imports_ms"].items():
+        print(f"  {ms:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Local stand-ins for the services the agent talks to, used by the benchmark harness.
+
+- FakeDynamoDB: in-memory tables for UserProfiles, salesforce_tokens and the checkpoints
+- FakeSalesforce: HTTP server for the query, sObject, composite and userinfo endpoints
+- ScriptedModel: replaces graph_shared.call_model with a fixed tool-calling script
+- FakeMCPServer: streamable HTTP MCP server exposing the Salesforce tools
+- install(): patches boto3 and DynamoDBSaver's table lookup so nothing reaches AWS
+"""
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CallCounter(Counter):
+    """Thread-safe counter of external calls, keyed by service and operation."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def record(self, key):
+        with self._lock:
+            self[key] += 1
+
+
+calls = CallCounter()
+
+
+# --- DynamoDB -------------------------------------------------------------
+
+class FakeBatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+
+class FakeTable:
+    KEYS = {
+        "UserProfiles": ("profile_id", "userid"),
+        "salesforce_tokens": ("wa_id",),
+        "profile_locks": ("profile_id",),
+        "whatsapp_checkpoint": ("PK", "SK"),
+    }
+
+    def __init__(self, name):
+        self.name = name
+        self.items = {}
+        self.key_names = self.KEYS.get(name, ("blob_key",))
+        self.bytes_written = 0
+
+    def _key(self, item):
+        return tuple(item[k] for k in self.key_names)
+
+    def put_item(self, Item, **kwargs):
+        calls.record(f"dynamodb.{self.name}.put_item")
+        self.items[self._key(Item)] = dict(Item)
+        self.bytes_written += _item_size(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        calls.record(f"dynamodb.{self.name}.get_item")
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        calls.record(f"dynamodb.{self.name}.update_item")
+        item = self.items.setdefault(self._key(Key), dict(Key))
+        for assignment in UpdateExpression.replace("SET ", "", 1).split(","):
+            name, value = (part.strip() for part in assignment.split("="))
+            item[name] = ExpressionAttributeValues[value]
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        calls.record(f"dynamodb.{self.name}.delete_item")
+        self.items.pop(self._key(Key), None)
+        return {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues=None, IndexName=None, FilterExpression=None, ScanIndexForward=True, **kwargs):
+        """Supports "attr = :v" strings and the boto3 conditions DynamoDBSaver uses; no paging."""
+        calls.record(f"dynamodb.{self.name}.query")
+        if isinstance(KeyConditionExpression, str):
+            attribute, placeholder = (part.strip() for part in KeyConditionExpression.split("="))
+            value = ExpressionAttributeValues[placeholder]
+            items = [item for item in self.items.values() if item.get(attribute) == value]
+        else:
+            items = [item for item in self.items.values() if _matches(item, KeyConditionExpression)]
+        if FilterExpression is not None:
+            items = [item for item in items if _matches(item, FilterExpression)]
+        if len(self.key_names) > 1:
+            items.sort(key=lambda item: item[self.key_names[1]], reverse=not ScanIndexForward)
+        return {"Items": [dict(item) for item in items]}
+
+    def batch_writer(self):
+        return FakeBatchWriter(self)
+
+
+def _matches(item, condition):
+    """Evaluates the eq / begins_with / AND conditions built with boto3.dynamodb.conditions."""
+    expression = condition.get_expression()
+    operator, values = expression["operator"], expression["values"]
+    if operator == "AND":
+        return all(_matches(item, value) for value in values)
+    attribute, value = values
+    actual = item.get(attribute.name)
+    if operator == "=":
+        return actual == value
+    if operator == "begins_with":
+        return isinstance(actual, str) and actual.startswith(value)
+    raise NotImplementedError(f"FakeTable does not support {operator} conditions")
+
+
+def _item_size(value):
+    """Approximate stored size of an item: the lengths of its strings and binaries."""
+    if isinstance(value, dict):
+        return sum(len(k) + _item_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_item_size(v) for v in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            calls.record(f"dynamodb.{name}.batch_get_item")
+            responses[name] = [dict(table.items[table._key(k)]) for k in request["Keys"] if table._key(k) in table.items]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+class FakeAWSClient:
+    """Stand-in for the boto3 clients used outside DynamoDB."""
+
+    def __init__(self, service, secrets=None):
+        self.service = service
+        self.secrets = secrets or {}
+
+    def get_secret_value(self, SecretId):
+        calls.record("secretsmanager.get_secret_value")
+        return {"SecretString": self.secrets.get(SecretId, f"fake-{SecretId}")}
+
+    def __getattr__(self, name):
+        def call(**kwargs):
+            calls.record(f"{self.service}.{name}")
+            return {"MessageId": str(uuid.uuid4())}
+        return call
+
+
+# --- Salesforce -----------------------------------------------------------
+
+class FakeSalesforce:
+    """Serves a small set of Salesforce REST endpoints from generated Opportunity rows."""
+
+    def __init__(self, record_count=450, page_size=200, latency_ms=0):
+        self.record_count = record_count
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _records(self, start, end):
+        return [
+            {
+                "attributes": {"type": "Opportunity", "url": f"/services/data/v60.0/sobjects/Opportunity/006{i:012d}"},
+                "Id": f"006{i:012d}",
+                "Name": f"Opportunity {i}",
+                "StageName": "Prospecting",
+                "Amount": 1000 + i,
+                "Account": {"attributes": {"type": "Account"}, "Name": f"Account {i % 17}"},
+            }
+            for i in range(start, min(end, self.record_count))
+        ]
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=None, headers=None):
+                payload = json.dumps(body).encode("utf-8") if body is not None else b""
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("Sforce-Limit-Info", "api-usage=25/15000")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _reply_text(self, status, text, headers):
+                payload = text.encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _route(self, method):
+                calls.record(f"salesforce.{method}")
+                if fake.latency_ms:
+                    time.sleep(fake.latency_ms / 1000)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                parsed = urllib.parse.urlsplit(self.path)
+                path = parsed.path
+
+                if path.endswith("/oauth2/userinfo"):
+                    return self._reply(200, {"user_id": "005000000000001", "name": "Bench User", "email": "bench@example.com"})
+                if path.endswith("/jobs/query") and method == "POST":
+                    return self._reply(200, {"id": "750000000000001", "state": "UploadComplete"})
+                match = re.search(r"/jobs/query/(\w+)/results$", path)
+                if match:
+                    query = urllib.parse.parse_qs(parsed.query)
+                    start = int(query.get("locator", ["0"])[0])
+                    end = min(start + int(query.get("maxRecords", ["50000"])[0]), fake.record_count)
+                    rows = ['"Id","Name","Amount"'] + [f'"006{i:012d}","Opportunity {i}","{1000 + i}"' for i in range(start, end)]
+                    return self._reply_text(200, "\n".join(rows) + "\n", {"Sforce-Locator": str(end) if end < fake.record_count else "null"})
+                match = re.search(r"/jobs/query/(\w+)$", path)
+                if match:
+                    return self._reply(200, {"id": match.group(1), "state": "JobComplete", "numberRecordsProcessed": fake.record_count})
+                if re.search(r"/query/?$", path):
+                    return self._reply(200, self._page(0))
+                match = re.search(r"/query/bench-(\d+)$", path)
+                if match:
+                    return self._reply(200, self._page(int(match.group(1))))
+                if path.endswith("/composite/sobjects"):
+                    return self._reply(200, [{"id": f"006{i:012d}", "success": True, "errors": []} for i, _ in enumerate(body["records"])])
+                if path.endswith("/composite"):
+                    return self._reply(200, {"compositeResponse": [
+                        {"body": {"id": "006000000000000", "success": True}, "httpStatusCode": 201 if r["method"] == "POST" else 200, "referenceId": r["referenceId"]}
+                        for r in body["compositeRequest"]
+                    ]})
+                match = re.search(r"/sobjects/(\w+)/describe$", path)
+                if match:
+                    if self.headers.get("If-Modified-Since") == DESCRIBE_LAST_MODIFIED:
+                        return self._reply(304)
+                    return self._reply(200, describe(match.group(1)), {"Last-Modified": DESCRIBE_LAST_MODIFIED})
+                if "/sobjects/" in path and method == "POST":
+                    return self._reply(201, {"id": "006000000000000", "success": True, "errors": []})
+                if "/sobjects/" in path and method == "PATCH":
+                    return self._reply(204)
+                if "/sobjects/" in path:
+                    return self._reply(200, fake._records(0, 1)[0])
+                return self._reply(404, [{"errorCode": "NOT_FOUND", "message": path}])
+
+            def _page(self, start):
+                end = start + fake.page_size
+                page = {"totalSize": fake.record_count, "done": end >= fake.record_count, "records": fake._records(start, end)}
+                if not page["done"]:
+                    page["nextRecordsUrl"] = f"/services/data/v60.0/query/bench-{end}"
+                return page
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_PATCH(self):
+                self._route("PATCH")
+
+        return Handler
+
+
+DESCRIBE_LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def describe(object_type, field_count=300):
+    """A describe payload roughly the size of a standard object's."""
+    fields = [
+        {"name": "Id", "label": f"{object_type} ID", "type": "id", "referenceTo": [], "relationshipName": None},
+        {"name": "Name", "label": "Name", "type": "string", "referenceTo": [], "relationshipName": None},
+        {"name": "AccountId", "label": "Account ID", "type": "reference", "referenceTo": ["Account"], "relationshipName": "Account"},
+        {"name": "StageName", "label": "Stage", "type": "picklist", "referenceTo": [], "relationshipName": None,
+         "picklistValues": [{"value": v, "active": True} for v in ("Prospecting", "Qualification", "Closed Won")]},
+        {"name": "Amount", "label": "Amount", "type": "currency", "referenceTo": [], "relationshipName": None},
+    ]
+    fields += [
+        {"name": f"Custom_{i}__c", "label": f"Custom {i}", "type": "string", "referenceTo": [], "relationshipName": None,
+         "inlineHelpText": "x" * 200, "defaultValue": None, "length": 255}
+        for i in range(field_count)
+    ]
+    return {
+        "name": object_type,
+        "label": object_type,
+        "fields": fields,
+        "childRelationships": [{"relationshipName": "OpportunityLineItems", "childSObject": "OpportunityLineItem", "field": "OpportunityId"}],
+    }
+
+
+# --- LLM ------------------------------------------------------------------
+
+class ScriptedModel:
+    """
+    Replaces call_model with a fixed plan per turn: look up the user, run a SOQL
+    query, then answer in the {"nextagent", "message"} contract.
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.tokens = 0
+
+    def __call__(self, model_name, provider_name, messages, json_tools):
+        from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+        calls.record("llm.call_model")
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        turn_start = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+        tool_results = [m for m in messages[turn_start:] if isinstance(m, ToolMessage)]
+        profile_id = re.search(r"ProfileID: (\S+)", messages[turn_start].content).group(1)
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        usage = {"input_tokens": prompt_chars // 4, "output_tokens": 40, "total_tokens": prompt_chars // 4 + 40}
+        self.tokens += usage["total_tokens"]
+
+        if len(tool_results) == 0:
+            tool_call = {"name": "execute_salesforce_rest", "args": {"object_type": "userinfo", "operation": "get", "profile_id": profile_id}}
+        elif len(tool_results) == 1:
+            tool_call = {"name": "execute_salesforce_soql", "args": {"soql_query": "SELECT Id, Name, StageName, Amount, Account.Name FROM Opportunity WHERE IsClosed = false", "profile_id": profile_id}}
+        else:
+            content = json.dumps({"nextagent": "comms-agent", "message": f"You have open opportunities ({len(tool_results)} lookups)."})
+            return AIMessage(content=content, usage_metadata=usage)
+
+        tool_call.update({"id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"})
+        return AIMessage(content="", tool_calls=[tool_call], usage_metadata=usage)
+
+
+# --- MCP ------------------------------------------------------------------
+
+class FakeMCPServer:
+    """Streamable HTTP MCP server whose tools call the fake Salesforce server."""
+
+    def __init__(self, salesforce):
+        from mcp.server.fastmcp import FastMCP
+        import requests
+
+        self.salesforce = salesforce
+        self.mcp = FastMCP("bench-salesforce", host="127.0.0.1", port=0)
+        session = requests.Session()
+
+        @self.mcp.tool()
+        def execute_salesforce_soql(soql_query: str, profile_id: str) -> dict:
+            """Executes a SOQL query."""
+            calls.record("mcp.tool_call")
+            return session.get(f"{salesforce.url}/services/data/v60.0/query", params={"q": soql_query}).json()
+
+        @self.mcp.tool()
+        def execute_salesforce_rest(object_type: str, operation: str, profile_id: str, data: dict = None, record_id: str = None) -> dict:
+            """Creates, updates or gets a Salesforce resource."""
+            calls.record("mcp.tool_call")
+            if object_type == "userinfo":
+                return session.get(f"{salesforce.url}/services/oauth2/userinfo").json()
+            return session.get(f"{salesforce.url}/services/data/v60.0/{object_type}").json()
+
+    def start(self):
+        import socket
+        import uvicorn
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        config = uvicorn.Config(self.mcp.streamable_http_app(), host="127.0.0.1", port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.url = f"http://127.0.0.1:{port}/mcp"
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+
+
+# --- Patching -------------------------------------------------------------
+
+_dynamodb = None
+
+
+def install(dynamodb):
+    """Routes boto3 and the real DynamoDBSaver to local stand-ins."""
+    global _dynamodb
+    import boto3
+    import langgraph_dynamodb_checkpoint
+
+    _dynamodb = dynamodb
+    boto3.resource = lambda service, *args, **kwargs: dynamodb
+    boto3.client = lambda service, *args, **kwargs: dynamodb if service == "dynamodb" else FakeAWSClient(service)
+    langgraph_dynamodb_checkpoint.DynamoDBSaver._get_or_create_table = lambda self, table_name, *args: dynamodb.Table(table_name)
+
+
+def checkpoint_bytes_written():
+    """Bytes of the items DynamoDBSaver and the chunked-blob table have written so far."""
+    tables = [_dynamodb.Table("whatsapp_checkpoint")]
+    blob_table = os.getenv("CHECKPOINT_BLOB_TABLE")
+    if blob_table:
+        tables.append(_dynamodb.Table(blob_table))
+    return sum(table.bytes_written for table in tables)
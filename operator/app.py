@@ -4,16 +4,155 @@ import boto3
 import inspect
 import traceback
 import asyncio
-from handler_non_mcp import handle_message
-from handler_mcp import handle_message_mcp
-
-stepfunctions = boto3.client("stepfunctions")
+from utils import resolve_profiles
+import profile_lock
+import outbound
+from tracing import start_trace, debug
 
 USE_MCP = os.getenv("USE_MCP", "n").lower() == "y"
-handler = handle_message_mcp if USE_MCP else handle_message
+
+_handler = None
+_stepfunctions = None
+
+def get_handler():
+    """Imports and initializes only the handler path selected by USE_MCP, on first use."""
+    global _handler
+    if _handler is None:
+        if USE_MCP:
+            from handler_mcp import handle_message_mcp
+            _handler = handle_message_mcp
+        else:
+            from handler_non_mcp import handle_message, get_app
+            get_app()
+            _handler = handle_message
+    return _handler
+
+def get_stepfunctions():
+    global _stepfunctions
+    if _stepfunctions is None:
+        _stepfunctions = boto3.client("stepfunctions")
+    return _stepfunctions
+
+# Kept across warm invocations so connections opened on it (e.g. MCP sessions) can be reused
+loop = asyncio.new_event_loop()
+
+# Maximum number of profiles processed in parallel within one SQS batch
+SQS_MAX_CONCURRENCY = int(os.getenv("SQS_MAX_CONCURRENCY", 4))
+# Set to y to merge consecutive messages of one sender in a batch into a single agent turn
+SQS_COALESCE = os.getenv("SQS_COALESCE", "n").lower() == "y"
+# Messages sent further apart than this are not merged, even within one batch
+COALESCE_WINDOW_MS = int(os.getenv("COALESCE_WINDOW_MS", 5000))
+
+async def call_handler(channel_type, recipient, message, event_id=None):
+    """
+    Runs the selected handler, off the event loop if it is synchronous. event_id names the
+    triggering event (SQS message ids or Step Functions task token); it stays the same when
+    the event is redelivered, so outbound sends can be deduplicated across retries.
+    """
+    handler = get_handler()
+    if inspect.iscoroutinefunction(handler):
+        return await handler(channel_type, recipient, message, event_id)
+    return await asyncio.to_thread(handler, channel_type, recipient, message, event_id)
+
+def coalesce_lane(lane):
+    """
+    Merges consecutive messages from the same sender and channel into one turn when
+    SQS_COALESCE is on and each was sent within COALESCE_WINDOW_MS of the previous one.
+
+    Returns turns as (message_ids, channel_type, recipient, message).
+    """
+    turns = []
+    last_sent = None
+    for message_id, channel_type, recipient, message, sent in lane:
+        previous = turns[-1] if turns else None
+        if (
+            SQS_COALESCE and previous
+            and previous[1:3] == [channel_type, recipient]
+            and (sent is None or last_sent is None or sent - last_sent <= COALESCE_WINDOW_MS)
+        ):
+            previous[0].append(message_id)
+            previous[3] += "\n" + message
+        else:
+            turns.append([[message_id], channel_type, recipient, message])
+        last_sent = sent
+    return turns
+
+async def process_sqs_batch(records):
+    """
+    Processes SQS records concurrently across profiles and in order within a profile.
+
+    Records sharing a profile_id use the same checkpoint thread, so they are run one
+    after another, under the profile's lease when PROFILE_LOCK_TABLE is set. Once a
+    record fails, or the lease is held by another invocation, the remaining records of
+    that profile are reported as failed too, so SQS redelivers them in their original order.
+
+    Returns the partial batch response expected by SQS: {"batchItemFailures": [...]}.
+    """
+    records_order = {record["messageId"]: i for i, record in enumerate(records)}
+    groups = {}
+    for record in records:
+        try:
+            body = json.loads(record["body"])
+        except (TypeError, ValueError):
+            print(f"Skipping message {record.get('messageId')} with invalid body")
+            continue
+
+        channel_type = body.get("channel_type")
+        recipient = body.get("from")
+        message = body.get("messages")
+
+        if not all([channel_type, recipient, message]):
+            print("Skipping message due to missing fields")
+            continue
+
+        sent = record.get("attributes", {}).get("SentTimestamp")
+        groups.setdefault(recipient, []).append((record["messageId"], channel_type, recipient, message, int(sent) if sent else None))
+
+    # Resolve profiles up front so different userids of one profile share an ordered lane
+    profiles = await asyncio.to_thread(resolve_profiles, list(groups))
+    lanes = {}
+    for recipient, profile in profiles.items():
+        profile_id = profile[0] if profile else None
+        lanes.setdefault(profile_id or recipient, (profile_id, []))[1].extend(groups[recipient])
+    for _, lane in lanes.values():
+        lane.sort(key=lambda item: records_order[item[0]])
+
+    semaphore = asyncio.Semaphore(SQS_MAX_CONCURRENCY)
+    failures = []
+
+    async def run_turns(turns):
+        for index, (message_ids, channel_type, recipient, message) in enumerate(turns):
+            try:
+                if len(message_ids) > 1:
+                    print(f"Coalesced {len(message_ids)} messages from {recipient} into one turn")
+                await call_handler(channel_type, recipient, message, ",".join(message_ids))
+            except Exception:
+                print(f"Failed to process messages {message_ids}:", traceback.format_exc())
+                failures.extend(message_id for turn in turns[index:] for message_id in turn[0])
+                return
+
+    async def run_lane(profile_id, lane):
+        turns = coalesce_lane(lane)
+        async with semaphore:
+            if not profile_id:
+                # Unknown sender; the handler skips it, nothing to serialize
+                return await run_turns(turns)
+            try:
+                owner = await asyncio.to_thread(profile_lock.acquire, profile_id)
+            except profile_lock.LeaseHeld as e:
+                print(f"{e}, returning {len(lane)} messages to the queue")
+                failures.extend(item[0] for item in lane)
+                return
+            try:
+                await run_turns(turns)
+            finally:
+                await asyncio.to_thread(profile_lock.release, profile_id, owner)
+
+    await asyncio.gather(*[run_lane(profile_id, lane) for profile_id, lane in lanes.values()])
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
 
 def lambda_handler(event, context):
-    print("Received event:", json.dumps(event, indent=2))
+    debug("Received event:", json.dumps(event, indent=2))
 
     async def process_event():
         try:
@@ -25,18 +164,15 @@ def lambda_handler(event, context):
                 recipient = input_data.get("from")
                 message = input_data.get("message")
 
-                if inspect.iscoroutinefunction(handler):
-                    result = await handler(channel_type, recipient, message)
-                else:
-                    result = handler(channel_type, recipient, message)
+                result = await call_handler(channel_type, recipient, message, task_token)
                 print("Handler result:", result)
                 if result:
-                    stepfunctions.send_task_success(
+                    get_stepfunctions().send_task_success(
                         taskToken=task_token,
                         output=json.dumps(result)
                     )
                 else:
-                    stepfunctions.send_task_failure(
+                    get_stepfunctions().send_task_failure(
                         taskToken=task_token,
                         error="UserProfileError",
                         cause="Missing profile or invalid input."
@@ -45,19 +181,15 @@ def lambda_handler(event, context):
 
             # Handle SQS event
             if "Records" in event:
-                for record in event["Records"]:
-                    body = json.loads(record["body"])
-                    channel_type = body.get("channel_type")
-                    recipient = body.get("from")
-                    message = body.get("messages")
-
-                    if not all([channel_type, recipient, message]):
-                        print("Skipping message due to missing fields")
-                        continue
-
-                    await handler(channel_type, recipient, message)
+                return await process_sqs_batch(event["Records"])
         except Exception as e:
             print("Unhandled error in process_event():", traceback.format_exc())
             raise
 
-    return asyncio.run(process_event())
+    source = "sfn" if "taskToken" in event else "sqs"
+    with start_trace("lambda_handler", Handler="mcp" if USE_MCP else "non_mcp", Source=source):
+        try:
+            return loop.run_until_complete(process_event())
+        finally:
+            # Replies are sent in the background; finish them before the container is frozen
+            outbound.drain()
@@ -0,0 +1,249 @@
+# checkpoint_coalescing.py
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+import boto3
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple
+from langgraph_dynamodb_checkpoint.dynamodbSerializer import DynamoDBSerializer
+from tracing import span
+
+# Payloads smaller than this are stored as-is; compressing them saves little
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", 1024))
+# Compressed payloads above this are moved to CHECKPOINT_BLOB_TABLE in chunks. DynamoDBSaver
+# base64-encodes payloads (4/3 larger), so this keeps the item under DynamoDB's 400 KB limit
+# with room for the other attributes
+CHECKPOINT_INLINE_MAX_BYTES = int(os.getenv("CHECKPOINT_INLINE_MAX_BYTES", (400 - 16) * 1024 * 3 // 4))
+CHECKPOINT_CHUNK_BYTES = 350 * 1024
+CHECKPOINT_BLOB_TABLE = os.getenv("CHECKPOINT_BLOB_TABLE")
+CHECKPOINT_TTL_SECONDS = int(os.getenv("CHECKPOINT_TTL_SECONDS", 86400))
+
+ZLIB_PREFIX = "zlib+"
+CHUNKED_PREFIX = "chunked+"
+
+
+class CompressingSerializer:
+    """
+    Wraps a checkpoint serializer to zlib-compress large payloads.
+
+    When a compressed payload is still too large for one DynamoDB item, it is split
+    into content-addressed chunks in CHECKPOINT_BLOB_TABLE and only a small reference
+    is stored in the checkpoint. Payloads written by the plain serializer still load.
+    """
+
+    def __init__(self, inner, blob_table=CHECKPOINT_BLOB_TABLE):
+        self.inner = inner
+        self.blob_table = blob_table
+        self.bytes_written = 0
+        self._dynamodb = boto3.resource("dynamodb") if blob_table else None
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def dumps_typed(self, obj):
+        type_, data = self.inner.dumps_typed(obj)
+        if len(data) >= CHECKPOINT_COMPRESS_MIN_BYTES:
+            type_, data = ZLIB_PREFIX + type_, zlib.compress(data)
+            if len(data) > CHECKPOINT_INLINE_MAX_BYTES and self.blob_table:
+                type_, data = CHUNKED_PREFIX + type_, self._put_chunks(data)
+        self.bytes_written += len(data)
+        return type_, data
+
+    def loads_typed(self, data):
+        type_, payload = data
+        if type_.startswith(CHUNKED_PREFIX):
+            type_, payload = type_[len(CHUNKED_PREFIX):], self._get_chunks(payload)
+        if type_.startswith(ZLIB_PREFIX):
+            type_, payload = type_[len(ZLIB_PREFIX):], zlib.decompress(payload)
+        return self.inner.loads_typed((type_, payload))
+
+    def _put_chunks(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        count = (len(data) + CHECKPOINT_CHUNK_BYTES - 1) // CHECKPOINT_CHUNK_BYTES
+        expires_at = int(time.time()) + CHECKPOINT_TTL_SECONDS
+        with self._dynamodb.Table(self.blob_table).batch_writer() as batch:
+            for i in range(count):
+                batch.put_item(Item={
+                    "blob_key": f"{digest}#{i}",
+                    "data": data[i * CHECKPOINT_CHUNK_BYTES:(i + 1) * CHECKPOINT_CHUNK_BYTES],
+                    "ttl": expires_at,
+                })
+        return json.dumps({"digest": digest, "chunks": count}).encode("utf-8")
+
+    def _get_chunks(self, reference):
+        ref = json.loads(reference)
+        keys = [{"blob_key": f"{ref['digest']}#{i}"} for i in range(ref["chunks"])]
+        chunks = {}
+        for start in range(0, len(keys), 100):
+            request = {self.blob_table: {"Keys": keys[start:start + 100]}}
+            while request:
+                response = self._dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.blob_table, []):
+                    chunks[item["blob_key"]] = bytes(item["data"])
+                request = response.get("UnprocessedKeys")
+        if len(chunks) != ref["chunks"]:
+            raise Exception(f"Checkpoint blob {ref['digest']} is missing chunks")
+        return b"".join(chunks[key["blob_key"]] for key in keys)
+
+
+class _TurnBuffer:
+    def __init__(self, base_config):
+        self.base_config = base_config
+        self.config = None
+        self.checkpoint = None
+        self.metadata = None
+        self.new_versions = {}
+        self.writes = {}
+
+
+class CoalescingSaver(BaseCheckpointSaver):
+    """
+    Checkpointer that keeps a turn's intermediate checkpoints in memory and writes only
+    the last one, plus its pending writes, to the wrapped saver on flush()/aflush().
+
+    Call flush (or aflush) once the graph invocation ends, including when it fails,
+    so the latest state and the writes needed to resume it are persisted.
+    """
+
+    def __init__(self, inner):
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(config):
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    def _buffered_tuple(self, config):
+        buffer = self._buffers.get(self._key(config))
+        if buffer is None or buffer.checkpoint is None:
+            return None
+        checkpoint_id = config["configurable"].get("checkpoint_id")
+        if checkpoint_id and checkpoint_id != buffer.checkpoint["id"]:
+            return None
+        pending_writes = [
+            (task_id, channel, value)
+            for _, task_id, writes, _ in buffer.writes.get(buffer.checkpoint["id"], [])
+            for channel, value in writes
+        ]
+        return CheckpointTuple(
+            config=buffer.config,
+            checkpoint=buffer.checkpoint,
+            metadata=buffer.metadata,
+            parent_config=buffer.base_config if buffer.base_config["configurable"].get("checkpoint_id") else None,
+            pending_writes=pending_writes,
+        )
+
+    def _buffer_put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            buffer = self._buffers.setdefault(self._key(config), _TurnBuffer(config))
+            buffer.config = {
+                "configurable": {
+                    "thread_id": config["configurable"]["thread_id"],
+                    "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                    "checkpoint_id": checkpoint["id"],
+                }
+            }
+            buffer.checkpoint = checkpoint
+            buffer.metadata = metadata
+            buffer.new_versions.update(new_versions)
+            return buffer.config
+
+    def _buffer_writes(self, config, writes, task_id, task_path):
+        with self._lock:
+            buffer = self._buffers.setdefault(self._key(config), _TurnBuffer(config))
+            checkpoint_id = config["configurable"].get("checkpoint_id")
+            buffer.writes.setdefault(checkpoint_id, []).append((config, task_id, list(writes), task_path))
+
+    def _pop_buffers(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            keys = [key for key in self._buffers if key[0] == thread_id]
+            return [self._buffers.pop(key) for key in keys]
+
+    def get_tuple(self, config):
+        buffered = self._buffered_tuple(config)
+        if buffered:
+            return buffered
+        with span("checkpoint.read"):
+            return self.inner.get_tuple(config)
+
+    async def aget_tuple(self, config):
+        buffered = self._buffered_tuple(config)
+        if buffered:
+            return buffered
+        with span("checkpoint.read"):
+            return await self.inner.aget_tuple(config)
+
+    def list(self, config, **kwargs):
+        return self.inner.list(config, **kwargs)
+
+    def alist(self, config, **kwargs):
+        return self.inner.alist(config, **kwargs)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self._buffer_put(config, checkpoint, metadata, new_versions)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return self._buffer_put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        self._buffer_writes(config, writes, task_id, task_path)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        self._buffer_writes(config, writes, task_id, task_path)
+
+    def get_next_version(self, current, channel):
+        return self.inner.get_next_version(current, channel)
+
+    def delete_thread(self, thread_id):
+        self._pop_buffers({"configurable": {"thread_id": thread_id}})
+        return self.inner.delete_thread(thread_id)
+
+    async def adelete_thread(self, thread_id):
+        self._pop_buffers({"configurable": {"thread_id": thread_id}})
+        return await self.inner.adelete_thread(thread_id)
+
+    def flush(self, config):
+        """Writes the thread's final buffered checkpoint and its pending writes."""
+        with span("checkpoint.write"):
+            self._flush(config)
+
+    def _flush(self, config):
+        for buffer in self._pop_buffers(config):
+            if buffer.checkpoint is None:
+                # No new checkpoint this turn; keep writes made against the stored one
+                for write_config, task_id, writes, task_path in [w for ws in buffer.writes.values() for w in ws]:
+                    self.inner.put_writes(write_config, writes, task_id, task_path)
+                continue
+            saved_config = self.inner.put(buffer.base_config, buffer.checkpoint, buffer.metadata, buffer.new_versions)
+            for _, task_id, writes, task_path in buffer.writes.get(buffer.checkpoint["id"], []):
+                self.inner.put_writes(saved_config, writes, task_id, task_path)
+
+    async def aflush(self, config):
+        """Async counterpart of flush()."""
+        with span("checkpoint.write"):
+            await self._aflush(config)
+
+    async def _aflush(self, config):
+        for buffer in self._pop_buffers(config):
+            if buffer.checkpoint is None:
+                for write_config, task_id, writes, task_path in [w for ws in buffer.writes.values() for w in ws]:
+                    await self.inner.aput_writes(write_config, writes, task_id, task_path)
+                continue
+            saved_config = await self.inner.aput(buffer.base_config, buffer.checkpoint, buffer.metadata, buffer.new_versions)
+            for _, task_id, writes, task_path in buffer.writes.get(buffer.checkpoint["id"], []):
+                await self.inner.aput_writes(saved_config, writes, task_id, task_path)
+
+
+def coalescing_saver(inner):
+    """Wraps a checkpointer with payload compression and turn-level write coalescing."""
+    inner.serde = CompressingSerializer(inner.serde)
+    if hasattr(inner, "dynamodb_serde"):
+        # DynamoDBSaver builds its base64 serializer from serde in __init__ and only uses that one
+        inner.dynamodb_serde = DynamoDBSerializer(inner.serde)
+    return CoalescingSaver(inner)
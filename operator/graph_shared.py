@@ -1,27 +1,71 @@
 # graph_shared.py
 import os
-from langchain_core.messages import SystemMessage
+import json
+import asyncio
+import hashlib
+from langchain_core.messages import SystemMessage, AIMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph_utils import call_model, create_tools_json
 from langgraph_reducer import PrunableStateFactory
-from langgraph.graph import END
-
-model_name = os.getenv("MODEL_NAME")
-provider_name = os.getenv("PROVIDER_NAME")
+from history_budget import TokenBudgetMessagesState
+from model_routing import call_routed
+from turn_budget import repeated_result
+from langgraph.graph import StateGraph, START, END
+from langgraph.prebuilt import ToolNode
 
 min_keep = int(os.getenv("MSG_HISTORY_TO_KEEP", 20))
 max_keep = int(os.getenv("DELETE_TRIGGER_COUNT", 30))
 
-PrunableMessagesState = PrunableStateFactory.create_prunable_state(min_keep, max_keep)
+# Maximum tool calls from one model response that run at the same time
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", 4))
+
+# "count" prunes by message count; "tokens" prunes to HISTORY_TOKEN_BUDGET estimated tokens
+HISTORY_PRUNE_MODE = os.getenv("HISTORY_PRUNE_MODE", "count").lower()
+
+if HISTORY_PRUNE_MODE == "tokens":
+    PrunableMessagesState = TokenBudgetMessagesState
+else:
+    PrunableMessagesState = PrunableStateFactory.create_prunable_state(min_keep, max_keep)
 
 def should_continue(state) -> str:
     last_message = state['messages'][-1]
     return "tools" if last_message.tool_calls else END
 
+PROMPT_FILE = "agent_prompt.txt"
+# Re-read the prompt whenever the file changes, useful while editing it locally
+PROMPT_RELOAD = os.getenv("AGENT_PROMPT_RELOAD", "n").lower() == "y"
+
+_system_message = None
+_prompt_mtime = None
+
+def get_system_message():
+    """Returns the agent system message, read from disk once per container."""
+    global _system_message, _prompt_mtime
+    if _system_message is not None and not PROMPT_RELOAD:
+        return _system_message
+
+    mtime = os.path.getmtime(PROMPT_FILE)
+    if _system_message is None or mtime != _prompt_mtime:
+        with open(PROMPT_FILE, "r", encoding="utf-8") as file:
+            _system_message = SystemMessage(content=file.read())
+        _prompt_mtime = mtime
+    return _system_message
+
+def model_tools_json(tools):
+    """create_tools_json without injected arguments such as config, which the model does not supply."""
+    tools_json = create_tools_json(tools)
+    for tool, tool_json in zip(tools, tools_json):
+        schema = tool.tool_call_schema
+        if hasattr(schema, "model_json_schema"):
+            tool_json["args_schema"] = schema.model_json_schema()
+    return tools_json
+
 def build_gw_model_fn(dynamic_tools):
-    def call_gw_model(state):
-        with open("agent_prompt.txt", "r", encoding="utf-8") as file:
-            system_prompt = file.read()
-        system_message = SystemMessage(content=system_prompt)
+    # Serialized once per tool set, so every model call sends a byte-identical prefix
+    json_tools = model_tools_json(dynamic_tools)
+
+    def call_gw_model(state, config):
+        system_message = get_system_message()
 
         messages = state["messages"]
         if isinstance(messages[0], SystemMessage):
@@ -29,8 +73,95 @@ def build_gw_model_fn(dynamic_tools):
         else:
             messages.insert(0, system_message)
 
-        json_tools = create_tools_json(dynamic_tools)
-        response = call_model(model_name, provider_name, messages, json_tools)
+        budget = config.get("configurable", {}).get("turn_budget")
+        if budget:
+            reason = budget.exhausted()
+            if reason:
+                # End the turn with a valid reply rather than running into the Lambda timeout
+                return {"messages": [AIMessage(content=budget.final_response(reason))]}
+            budget.add_step()
+
+        # Picks the fast or primary model for this step, with timeout and hedging
+        try:
+            response = call_routed(call_model, messages, json_tools, budget)
+        except TimeoutError:
+            if not budget:
+                raise
+            # The timeout was capped by the turn's remaining time, so the turn is out of time
+            return {"messages": [AIMessage(content=budget.final_response("deadline"))]}
         return {"messages": [response]}
 
     return call_gw_model
+
+def build_tools_node(tools):
+    """
+    Wraps ToolNode so that, under ainvoke, independent tool calls from one model
+    response run concurrently with at most TOOL_MAX_CONCURRENCY in flight.
+    The sync path is ToolNode's own, which already runs calls in a thread pool.
+
+    With a turn_budget in the config, a call identical to an earlier one in the same
+    turn gets the earlier result instead of running again.
+    """
+    tool_node = ToolNode(tools=tools)
+
+    def call_tools(state, config):
+        budget = config.get("configurable", {}).get("turn_budget")
+        if not budget:
+            return tool_node.invoke(state, config)
+
+        tool_calls = state["messages"][-1].tool_calls
+        results = {}
+        pending = []
+        for tool_call in tool_calls:
+            cached = budget.cached_tool_result(tool_call)
+            if cached:
+                budget.memo_hits += 1
+                results[tool_call["id"]] = repeated_result(tool_call, cached)
+            else:
+                pending.append(tool_call)
+
+        if pending:
+            output = tool_node.invoke({"messages": [AIMessage(content="", tool_calls=pending)]}, config)
+            for tool_call, message in zip(pending, output["messages"]):
+                budget.remember_tool_result(tool_call, message)
+                results[tool_call["id"]] = message
+        return {"messages": [results[tool_call["id"]] for tool_call in tool_calls]}
+
+    async def acall_tools(state, config):
+        tool_calls = state["messages"][-1].tool_calls
+        budget = config.get("configurable", {}).get("turn_budget")
+        semaphore = asyncio.Semaphore(TOOL_MAX_CONCURRENCY)
+
+        async def run_one(tool_call):
+            cached = budget.cached_tool_result(tool_call) if budget else None
+            if cached:
+                budget.memo_hits += 1
+                return [repeated_result(tool_call, cached)]
+            async with semaphore:
+                result = await tool_node.ainvoke({"messages": [AIMessage(content="", tool_calls=[tool_call])]}, config)
+            if budget:
+                budget.remember_tool_result(tool_call, result["messages"][0])
+            return result["messages"]
+
+        results = await asyncio.gather(*[run_one(tool_call) for tool_call in tool_calls])
+        return {"messages": [message for messages in results for message in messages]}
+
+    return RunnableLambda(call_tools, afunc=acall_tools, name="tools")
+
+def build_graph(tools):
+    """Builds the agent/tools loop for the given tools, ready to be compiled."""
+    graph = StateGraph(PrunableMessagesState)
+    graph.add_node("agent", build_gw_model_fn(tools))
+    graph.add_node("tools", build_tools_node(tools))
+    graph.add_edge(START, "agent")
+    graph.add_conditional_edges("agent", should_continue, ["tools", END])
+    graph.add_edge("tools", "agent")
+    return graph
+
+def tools_fingerprint(tools):
+    """Returns a stable hash of tool names, descriptions and argument schemas."""
+    catalog = [
+        {"name": t.name, "description": t.description, "args": t.args}
+        for t in sorted(tools, key=lambda t: t.name)
+    ]
+    return hashlib.sha256(json.dumps(catalog, sort_keys=True, default=str).encode("utf-8")).hexdigest()
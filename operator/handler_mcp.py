@@ -1,28 +1,62 @@
 # handler_mcp.py
 import json
 import os
-from utils import get_profile_id, get_all_userids_and_channels
-from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode
+from utils import resolve_profile
+from router import route
+from tracing import callbacks, debug
+from turn_budget import TurnBudget
 from langchain_core.messages import HumanMessage
 from langgraph_dynamodb_checkpoint import DynamoDBSaver
-from mcp import ClientSession
-from mcp.client.streamable_http import streamablehttp_client
-from langchain_mcp_adapters.tools import load_mcp_tools
-from graph_shared import build_gw_model_fn, should_continue, PrunableMessagesState
+from mcp_connection import get_connection_manager
+from checkpoint_coalescing import coalescing_saver
+from graph_shared import build_graph, tools_fingerprint
 
-async def handle_message_mcp(channel_type, recipient, message):
+_saver = None
+_app_cache = {}
+
+def get_checkpointer():
+    """Returns the checkpointer shared by every compiled graph in this container."""
+    global _saver
+    if _saver is None:
+        with DynamoDBSaver.from_conn_info(table_name="whatsapp_checkpoint", max_write_request_units=100, max_read_request_units=100, ttl_seconds=86400) as saver:
+            # Only each turn's final state is written, compressed
+            _saver = coalescing_saver(saver)
+    return _saver
+
+def get_app(mcp_tools):
+    """Returns the compiled graph for the MCP tool set, recompiling only when the catalog changes."""
+    fingerprint = tools_fingerprint(mcp_tools)
+    if fingerprint not in _app_cache:
+        print(f"Compiling agent graph for tool catalog {fingerprint[:12]}")
+        _app_cache.clear()
+        _app_cache[fingerprint] = build_graph(mcp_tools).compile(checkpointer=get_checkpointer())
+    return _app_cache[fingerprint]
+
+async def handle_message_mcp(channel_type, recipient, message, event_id=None):
     mcp_server_url = os.environ.get("MCP_SERVER_URL")
     if not mcp_server_url:
         print("MCP_SERVER_URL environment variable is not set. Exiting.")
         return None
 
-    profile_id = get_profile_id(recipient)
-    if not profile_id:
+    profile = resolve_profile(recipient)
+    if not profile:
         print(f"No profile for user: {recipient}, skipping.")
         return None
 
-    user_profiles = get_all_userids_and_channels(profile_id)
+    profile_id, user_profiles = profile
+
+    reply = route({"channel_type": channel_type, "recipient": recipient, "profile_id": profile_id, "message": message})
+    if reply:
+        # Deterministic reply, no model call needed
+        return {
+            "fromagent": "sf-agent",
+            "nextagent": reply["nextagent"],
+            "message": reply["message"],
+            "thread_id": profile_id,
+            "channel_type": channel_type,
+            "from": recipient
+        }
+
     profile_info = "\n".join([f"- UserID: {uid}, Channel: {ch}" for uid, ch in user_profiles])
 
     prompt = (
@@ -36,25 +70,19 @@ async def handle_message_mcp(channel_type, recipient, message):
     )
 
     input_message = {"messages": [HumanMessage(prompt)]}
-    config = {"configurable": {"thread_id": profile_id}}
-
-    async with streamablehttp_client(mcp_server_url) as (read, write, _):
-        async with ClientSession(read, write) as client:
-            await client.initialize()
-            mcp_tools = await load_mcp_tools(client)
+    config = {"configurable": {"thread_id": profile_id, "turn_budget": TurnBudget(), "event_id": event_id}, "callbacks": callbacks()}
 
-            graph = StateGraph(PrunableMessagesState)
-            graph.add_node("agent", build_gw_model_fn(mcp_tools))
-            graph.add_node("tools", ToolNode(tools=mcp_tools))
-            graph.add_edge(START, "agent")
-            graph.add_conditional_edges("agent", should_continue, ["tools", END])
-            graph.add_edge("tools", "agent")
+    connection = get_connection_manager(mcp_server_url)
+    mcp_tools = await connection.get_tools()
+    print("MCP connection stats:", connection.stats())
 
-            with DynamoDBSaver.from_conn_info(table_name="whatsapp_checkpoint", max_write_request_units=100, max_read_request_units=100, ttl_seconds=86400) as saver:
-                dynamic_app = graph.compile(checkpointer=saver)
-                response = await dynamic_app.ainvoke(input_message, config)
+    dynamic_app = get_app(mcp_tools)
+    try:
+        response = await dynamic_app.ainvoke(input_message, config)
+    finally:
+        await get_checkpointer().aflush(config)
 
-    print("Response from agent:", response)
+    debug("Response from agent:", response)
     agent_response = response["messages"][-1].content
     parsed_response = json.loads(agent_response)
 
@@ -1,35 +1,56 @@
 # handler_non_mcp.py
 import json
+import asyncio
 from tools import tool_list
-from utils import get_profile_id, get_all_userids_and_channels
-from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode
+from sf_cache import read_cache
+from utils import resolve_profile
+from router import route
+from tracing import callbacks, debug
+from turn_budget import TurnBudget
 from langgraph_dynamodb_checkpoint import DynamoDBSaver
-import boto3
 from langchain_core.messages import HumanMessage
-from graph_shared import build_gw_model_fn, should_continue, PrunableMessagesState
+from graph_shared import build_graph
+from checkpoint_coalescing import coalescing_saver
 
-tool_node = ToolNode(tools=tool_list)
+saver = None
 
 def init_graph():
-    with DynamoDBSaver.from_conn_info(table_name="whatsapp_checkpoint", max_write_request_units=100, max_read_request_units=100, ttl_seconds=86400) as saver:
-        graph = StateGraph(PrunableMessagesState)
-        graph.add_node("agent", build_gw_model_fn(tool_list))
-        graph.add_node("tools", tool_node)
-        graph.add_edge(START, "agent")
-        graph.add_conditional_edges("agent", should_continue, ["tools", END])
-        graph.add_edge("tools", "agent")
-        return graph.compile(checkpointer=saver)
-
-app = init_graph()
-
-def handle_message(channel_type, recipient, message):
-    profile_id = get_profile_id(recipient)
-    if not profile_id:
+    global saver
+    with DynamoDBSaver.from_conn_info(table_name="whatsapp_checkpoint", max_write_request_units=100, max_read_request_units=100, ttl_seconds=86400) as dynamodb_saver:
+        # Only each turn's final state is written, compressed
+        saver = coalescing_saver(dynamodb_saver)
+        return build_graph(tool_list).compile(checkpointer=saver)
+
+_app = None
+
+def get_app():
+    """Returns the compiled graph, built on first use rather than at import."""
+    global _app
+    if _app is None:
+        _app = init_graph()
+    return _app
+
+async def handle_message(channel_type, recipient, message, event_id=None):
+    # DynamoDB lookups are blocking, so they run off the event loop shared by the SQS batch
+    profile = await asyncio.to_thread(resolve_profile, recipient)
+    if not profile:
         print(f"No profile for user: {recipient}, skipping.")
         return None
 
-    user_profiles = get_all_userids_and_channels(profile_id)
+    profile_id, user_profiles = profile
+
+    reply = await asyncio.to_thread(route, {"channel_type": channel_type, "recipient": recipient, "profile_id": profile_id, "message": message})
+    if reply:
+        # Deterministic reply, no model call needed
+        return {
+            "fromagent": "sf-agent",
+            "nextagent": reply["nextagent"],
+            "message": reply["message"],
+            "thread_id": profile_id,
+            "channel_type": channel_type,
+            "from": recipient
+        }
+
     profile_info = "\n".join([f"- UserID: {uid}, Channel: {ch}" for uid, ch in user_profiles])
 
     prompt = (
@@ -43,10 +64,16 @@ def handle_message(channel_type, recipient, message):
     )
 
     input_message = {"messages": [HumanMessage(prompt)]}
-    config = {"configurable": {"thread_id": profile_id}}
+    config = {"configurable": {"thread_id": profile_id, "turn_budget": TurnBudget(), "event_id": event_id}, "callbacks": callbacks()}
 
-    response = app.invoke(input_message, config)
-    print("Response from agent:", response)
+    app = get_app()
+    try:
+        # Async so the tools' async variants run and one response's tool calls run concurrently
+        response = await app.ainvoke(input_message, config)
+    finally:
+        await saver.aflush(config)
+    debug("Response from agent:", response)
+    print("Salesforce read cache stats:", read_cache.stats())
     agent_response = response["messages"][-1].content
     parsed_response = json.loads(agent_response)
 
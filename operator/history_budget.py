@@ -0,0 +1,104 @@
+# history_budget.py
+import os
+import json
+from typing import Annotated, TypedDict
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.graph.message import add_messages
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 12000))
+# Tool results from earlier turns larger than this are replaced with a digest
+TOOL_RESULT_DIGEST_TOKENS = int(os.getenv("TOOL_RESULT_DIGEST_TOKENS", 300))
+
+CHARS_PER_TOKEN = 4
+DIGEST_SAMPLE_ROWS = 3
+
+
+def estimate_tokens(message):
+    """Rough token estimate for a message, from its content and tool call arguments."""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+    size = len(content)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        size += len(tool_call["name"]) + len(json.dumps(tool_call["args"], default=str))
+    return size // CHARS_PER_TOKEN + 1
+
+
+def digest_tool_result(content):
+    """Returns a compact digest of a tool result, keeping its shape and a few sample rows."""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        keep = TOOL_RESULT_DIGEST_TOKENS * CHARS_PER_TOKEN
+        return f"{content[:keep]}... [truncated {len(content) - keep} chars of an earlier tool result]"
+
+    digest = {"digest": "Earlier tool result, shortened. Re-run the tool if details are needed."}
+    if isinstance(data, dict) and "rows" in data:
+        digest.update({k: data.get(k) for k in ("totalSize", "columns", "truncated") if k in data})
+        digest["sample_rows"] = data["rows"][:DIGEST_SAMPLE_ROWS]
+        digest["omitted_rows"] = max(0, len(data["rows"]) - DIGEST_SAMPLE_ROWS)
+    elif isinstance(data, list):
+        digest["items"] = len(data)
+        digest["sample"] = data[:DIGEST_SAMPLE_ROWS]
+    elif isinstance(data, dict):
+        digest["fields"] = list(data.keys())
+        digest["values"] = {k: v for k, v in data.items() if not isinstance(v, (dict, list))}
+    else:
+        digest["value"] = data
+
+    text = json.dumps(digest, default=str)
+    keep = TOOL_RESULT_DIGEST_TOKENS * CHARS_PER_TOKEN
+    return text if len(text) <= keep else f"{text[:keep]}... [truncated]"
+
+
+def _last_turn_start(messages):
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return index
+    return 0
+
+
+def prune_to_budget(messages, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Shrinks history to an estimated token budget while keeping tool call/result pairs intact.
+
+    Earlier turns' large tool results are replaced with digests first, then the oldest
+    whole turns (a HumanMessage and everything up to the next one) are dropped. A leading
+    SystemMessage and the current turn are always kept.
+    """
+    sizes = [estimate_tokens(m) for m in messages]
+    total = sum(sizes)
+    if total <= budget:
+        return messages
+
+    messages = list(messages)
+    current_turn = _last_turn_start(messages)
+
+    for index in range(current_turn):
+        if total <= budget:
+            return messages
+        message = messages[index]
+        if isinstance(message, ToolMessage) and sizes[index] > TOOL_RESULT_DIGEST_TOKENS:
+            content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+            messages[index] = message.model_copy(update={"content": digest_tool_result(content)})
+            new_size = estimate_tokens(messages[index])
+            total -= sizes[index] - new_size
+            sizes[index] = new_size
+
+    head = 1 if messages and isinstance(messages[0], SystemMessage) else 0
+    start = head
+    while total > budget and start < current_turn:
+        # Advance to the start of the next turn so tool results never lose their call
+        end = start + 1
+        while end < current_turn and not isinstance(messages[end], HumanMessage):
+            end += 1
+        total -= sum(sizes[start:end])
+        start = end
+
+    return messages[:head] + messages[start:]
+
+
+def token_budget_reducer(left, right):
+    return prune_to_budget(add_messages(left, right))
+
+
+class TokenBudgetMessagesState(TypedDict):
+    messages: Annotated[list[AnyMessage], token_budget_reducer]
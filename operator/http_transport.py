@@ -0,0 +1,174 @@
+# http_transport.py
+import os
+import asyncio
+import time
+import random
+import threading
+import urllib.parse
+import requests
+from tracing import span
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 20))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 2))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+# Upper bound on any Retry-After wait, so a throttled call cannot outlive the Lambda
+HTTP_MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", 5))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+SF_API_USAGE_WARN_RATIO = float(os.getenv("SF_API_USAGE_WARN_RATIO", 0.9))
+# Requests to an org at this share of its daily API limit fail without being sent; 0 disables
+SF_API_USAGE_MAX_RATIO = float(os.getenv("SF_API_USAGE_MAX_RATIO", 0.98))
+# How long a recorded usage blocks requests before one is let through to refresh it
+SF_API_USAGE_TTL_SECONDS = float(os.getenv("SF_API_USAGE_TTL_SECONDS", 300))
+
+# Latest Salesforce org API usage per host, from the Sforce-Limit-Info header: (used, limit, recorded_at)
+api_usage = {}
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+RETRY_STATUSES = (429, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_async_client = None
+_async_client_loop = None
+
+
+class ApiUsageExceeded(Exception):
+    """The Salesforce org is at SF_API_USAGE_MAX_RATIO of its daily API limit."""
+
+
+class BoundedRetry(Retry):
+    """Retry policy that caps server-requested Retry-After delays."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, HTTP_MAX_RETRY_AFTER)
+
+
+def _record_limit_info(resp, *args, **kwargs):
+    """Response hook that tracks Salesforce API usage, e.g. 'api-usage=25/15000'."""
+    limit_info = resp.headers.get("Sforce-Limit-Info")
+    if not limit_info:
+        return
+    for part in limit_info.split(","):
+        name, _, value = part.strip().partition("=")
+        if name != "api-usage" or "/" not in value:
+            continue
+        used, limit = (int(v) for v in value.split("/", 1))
+        host = urllib.parse.urlsplit(str(resp.url)).netloc
+        api_usage[host] = (used, limit, time.monotonic())
+        if limit and used / limit >= SF_API_USAGE_WARN_RATIO:
+            print(f"Salesforce API usage for {host} at {used}/{limit}")
+
+
+def check_api_usage(host):
+    """
+    Raises ApiUsageExceeded if the host's last recorded usage, within SF_API_USAGE_TTL_SECONDS,
+    is at SF_API_USAGE_MAX_RATIO of its limit, so the agent does not use up the org's remaining calls.
+    """
+    usage = api_usage.get(host)
+    if not usage or not SF_API_USAGE_MAX_RATIO:
+        return
+    used, limit, recorded_at = usage
+    if limit and used / limit >= SF_API_USAGE_MAX_RATIO and time.monotonic() - recorded_at < SF_API_USAGE_TTL_SECONDS:
+        raise ApiUsageExceeded(f"Salesforce API usage for {host} is at {used}/{limit}; try again later.")
+
+
+def _build_session():
+    # Only idempotent methods are retried; POST/PATCH are sent once
+    retry = BoundedRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(_record_limit_info)
+    return session
+
+
+def get_session():
+    """Returns the process-wide pooled keep-alive session."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def request(method, url, **kwargs):
+    """Sends a request on the shared session with default connect/read timeouts."""
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    host = urllib.parse.urlsplit(url).netloc
+    check_api_usage(host)
+    with span("http", method=method, host=host) as attrs:
+        resp = get_session().request(method, url, **kwargs)
+        attrs["status"] = resp.status_code
+        if not kwargs.get("stream"):
+            # Reading content of a streamed response would load it all into memory
+            attrs["bytes"] = len(resp.content)
+    return resp
+
+
+def _retry_after_seconds(resp, attempt):
+    """Delay before retry attempt, honouring Retry-After up to HTTP_MAX_RETRY_AFTER."""
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            # HTTP-date form; wait the maximum rather than parse it
+            delay = HTTP_MAX_RETRY_AFTER
+        return max(0.0, min(delay, HTTP_MAX_RETRY_AFTER))
+    return HTTP_BACKOFF_FACTOR * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def _arecord_limit_info(resp):
+    _record_limit_info(resp)
+
+
+def get_async_client():
+    """Returns the pooled async client for the running event loop."""
+    global _async_client, _async_client_loop
+    # Imported here so the sync path does not pay for httpx at cold start
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        # Connections belong to the loop that opened them, so a new loop gets a new client
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE * 10, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_MAX_RETRIES),
+            event_hooks={"response": [_arecord_limit_info]},
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def arequest(method, url, **kwargs):
+    """
+    Async counterpart of request(). Idempotent requests are retried on 429/5xx
+    with the same bounded backoff; connection errors are retried by the transport.
+    """
+    client = get_async_client()
+    host = urllib.parse.urlsplit(url).netloc
+    check_api_usage(host)
+    retries = HTTP_MAX_RETRIES if method.upper() in IDEMPOTENT_METHODS else 0
+    for attempt in range(retries + 1):
+        with span("http", method=method, host=host) as attrs:
+            resp = await client.request(method, url, **kwargs)
+            attrs.update(status=resp.status_code, bytes=len(resp.content))
+        if resp.status_code not in RETRY_STATUSES or attempt == retries:
+            return resp
+        await asyncio.sleep(_retry_after_seconds(resp, attempt))
@@ -0,0 +1,145 @@
+# mcp_connection.py
+import asyncio
+import os
+import time
+from mcp import ClientSession, types
+from mcp.client.streamable_http import streamablehttp_client
+from langchain_mcp_adapters.tools import load_mcp_tools
+from tracing import span
+
+MCP_TOOLS_TTL_SECONDS = int(os.getenv("MCP_TOOLS_TTL_SECONDS", 300))
+MCP_PING_AFTER_SECONDS = int(os.getenv("MCP_PING_AFTER_SECONDS", 30))
+MCP_PING_TIMEOUT_SECONDS = float(os.getenv("MCP_PING_TIMEOUT_SECONDS", 2))
+
+
+class _SessionProxy:
+    """Forwards calls to the manager's current session, so loaded tools survive reconnects."""
+
+    def __init__(self, manager):
+        self._manager = manager
+
+    def __getattr__(self, name):
+        session = self._manager.session
+        if session is None:
+            raise ConnectionError("MCP session is not connected.")
+        return getattr(session, name)
+
+
+class MCPConnectionManager:
+    """
+    Keeps one MCP client session and its tool catalog alive across warm invocations.
+
+    The transport and session contexts are owned by a background task, so they are
+    entered and exited in the same task regardless of which invocation uses them.
+    The tool catalog is reloaded after MCP_TOOLS_TTL_SECONDS or when the server sends
+    a tools/list_changed notification.
+    """
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+        self.session = None
+        self.tools = None
+        self.reused = 0
+        self.rebuilt = 0
+        self._proxy = _SessionProxy(self)
+        self._loop = None
+        self._lock = None
+        self._owner = None
+        self._closed = None
+        self._tools_loaded_at = 0.0
+        self._tools_changed = False
+        self._last_used = 0.0
+
+    async def _on_message(self, message):
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+            self._tools_changed = True
+
+    async def _own_connection(self, ready):
+        try:
+            async with streamablehttp_client(self.server_url) as (read, write, _):
+                async with ClientSession(read, write, message_handler=self._on_message) as session:
+                    with span("mcp.initialize"):
+                        await session.initialize()
+                    self.session = session
+                    ready.set_result(None)
+                    await self._closed.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                print(f"MCP connection to {self.server_url} closed with error: {e}")
+        finally:
+            self.session = None
+
+    async def _is_healthy(self):
+        if self.session is None or self._owner is None or self._owner.done():
+            return False
+        if time.monotonic() - self._last_used < MCP_PING_AFTER_SECONDS:
+            return True
+        try:
+            with span("mcp.ping"):
+                await asyncio.wait_for(self.session.send_ping(), MCP_PING_TIMEOUT_SECONDS)
+            return True
+        except Exception as e:
+            print(f"MCP session health check failed: {e}")
+            return False
+
+    async def _connect(self):
+        await self.close()
+        self._closed = asyncio.Event()
+        ready = asyncio.get_running_loop().create_future()
+        self._owner = asyncio.create_task(self._own_connection(ready))
+        await ready
+        # Tools are bound to the session proxy, but the catalog may differ on a new session
+        self._tools_changed = True
+
+    async def close(self):
+        """Closes the current session, if any."""
+        if self._owner is not None and not self._owner.done():
+            self._closed.set()
+            try:
+                await asyncio.wait_for(self._owner, MCP_PING_TIMEOUT_SECONDS)
+            except Exception:
+                self._owner.cancel()
+        self._owner = None
+        self.session = None
+
+    async def get_tools(self):
+        """Returns the MCP tools, reconnecting and refreshing the catalog when needed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Sessions are bound to the loop they were opened on; start over on a new loop
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._owner = None
+            self.session = None
+            self.tools = None
+
+        async with self._lock:
+            if await self._is_healthy():
+                self.reused += 1
+            else:
+                with span("mcp.connect"):
+                    await self._connect()
+                self.rebuilt += 1
+
+            if self.tools is None or self._tools_changed or time.monotonic() - self._tools_loaded_at > MCP_TOOLS_TTL_SECONDS:
+                self._tools_changed = False
+                with span("mcp.load_tools"):
+                    self.tools = await load_mcp_tools(self._proxy)
+                self._tools_loaded_at = time.monotonic()
+
+            self._last_used = time.monotonic()
+            return self.tools
+
+    def stats(self):
+        return {"reused": self.reused, "rebuilt": self.rebuilt}
+
+
+_managers = {}
+
+def get_connection_manager(server_url):
+    """Returns the process-wide connection manager for an MCP server URL."""
+    if server_url not in _managers:
+        _managers[server_url] = MCPConnectionManager(server_url)
+    return _managers[server_url]
@@ -0,0 +1,125 @@
+# model_routing.py
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from langchain_core.messages import HumanMessage, ToolMessage
+from tracing import span, add_tokens
+
+# Primary model, used for final answers and after tool errors
+MODEL_NAME = os.getenv("MODEL_NAME")
+PROVIDER_NAME = os.getenv("PROVIDER_NAME")
+# Cheaper model for steps that plan tool calls; tiering is off when unset
+FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME")
+FAST_PROVIDER_NAME = os.getenv("FAST_PROVIDER_NAME", PROVIDER_NAME)
+# Set to y to keep a fast-model final answer that is valid {"nextagent", "message"} JSON
+FAST_MODEL_FINAL_ANSWERS = os.getenv("FAST_MODEL_FINAL_ANSWERS", "n").lower() == "y"
+# Second model raced against a slow call; hedging is off when unset
+HEDGE_MODEL_NAME = os.getenv("HEDGE_MODEL_NAME")
+HEDGE_PROVIDER_NAME = os.getenv("HEDGE_PROVIDER_NAME", PROVIDER_NAME)
+MODEL_HEDGE_AFTER_SECONDS = float(os.getenv("MODEL_HEDGE_AFTER_SECONDS", 8))
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", 45))
+
+# Calls that lose a hedge or time out finish in the background, so leave room for them
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="model")
+
+
+def choose_tier(messages):
+    """
+    Returns "fast" for steps expected to plan tool calls, "primary" otherwise.
+
+    A turn starts on the fast model and stays there while tools succeed. A tool error
+    sends the rest of the turn to the primary model. A fast response that answers the
+    user instead of calling a tool is redone by the primary model (see call_routed),
+    unless FAST_MODEL_FINAL_ANSWERS is on and the answer is valid.
+    """
+    if not FAST_MODEL_NAME:
+        return "primary"
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage) and message.status == "error":
+            return "primary"
+    return "fast"
+
+
+def _is_final_answer(response):
+    """True if the response content is a {"nextagent", "message"} JSON reply."""
+    if not isinstance(response.content, str):
+        return False
+    try:
+        answer = json.loads(response.content)
+    except ValueError:
+        return False
+    return isinstance(answer, dict) and "nextagent" in answer and "message" in answer
+
+
+def _target(tier):
+    if tier == "fast":
+        return FAST_MODEL_NAME, FAST_PROVIDER_NAME
+    return MODEL_NAME, PROVIDER_NAME
+
+
+def call_hedged(call, model, provider, messages, json_tools, timeout=MODEL_TIMEOUT_SECONDS):
+    """
+    Calls the model with a timeout (MODEL_TIMEOUT_SECONDS by default). If no response arrives within
+    MODEL_HEDGE_AFTER_SECONDS, the same request is also sent to HEDGE_MODEL_NAME and the
+    first successful response wins.
+
+    Raises:
+        TimeoutError: If no model responds before the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    pending = {_executor.submit(call, model, provider, messages, json_tools): model}
+    hedge_at = time.monotonic() + MODEL_HEDGE_AFTER_SECONDS if HEDGE_MODEL_NAME and HEDGE_MODEL_NAME != model else None
+    error = None
+
+    while pending:
+        wake_at = min(deadline, hedge_at) if hedge_at else deadline
+        done, _ = wait(pending, timeout=max(0, wake_at - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                return name, future.result()
+            except Exception as e:
+                print(f"Model {name} failed: {e}")
+                error = e
+        if hedge_at and (time.monotonic() >= hedge_at or not pending):
+            print(f"Model {model} is slow or failed, hedging to {HEDGE_MODEL_NAME}")
+            pending[_executor.submit(call, HEDGE_MODEL_NAME, HEDGE_PROVIDER_NAME, messages, json_tools)] = HEDGE_MODEL_NAME
+            hedge_at = None
+        if time.monotonic() >= deadline:
+            break
+
+    if error and not pending:
+        raise error
+    raise TimeoutError(f"No model response within {timeout:.1f}s")
+
+
+def call_routed(call, messages, json_tools, budget=None):
+    """
+    Calls the model tier chosen for this step, escalating fast final answers to the
+    primary model. With a turn budget, token usage is charged to it and the timeout is
+    capped by the turn's remaining time.
+    """
+    tier = choose_tier(messages)
+    while True:
+        model, provider = _target(tier)
+        timeout = MODEL_TIMEOUT_SECONDS
+        if budget and budget.remaining_seconds() is not None:
+            timeout = min(timeout, budget.remaining_seconds())
+        with span("call_model", model=model, tier=tier) as attrs:
+            answered_by, response = call_hedged(call, model, provider, messages, json_tools, timeout)
+            if answered_by != model:
+                attrs["hedged_to"] = answered_by
+        add_tokens(getattr(response, "usage_metadata", None))
+        if budget:
+            budget.add_tokens(getattr(response, "usage_metadata", None))
+
+        if tier == "fast" and (getattr(response, "invalid_tool_calls", None) or (
+            not response.tool_calls and not (FAST_MODEL_FINAL_ANSWERS and _is_final_answer(response))
+        )):
+            # The fast model only plans tool calls; the user-facing answer comes from the primary model
+            tier = "primary"
+            continue
+        return response
@@ -0,0 +1,359 @@
+# outbound.py
+import os
+import json
+import time
+import uuid
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+import boto3
+import requests
+from botocore.exceptions import ClientError, EndpointConnectionError
+import http_transport
+from utils import get_secret
+from tracing import emit_metrics
+
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 4))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", 3))
+# A delivery submitted again with the same idempotency key within this time is not resent;
+# should exceed the time SQS or Step Functions take to retry a failed invocation
+OUTBOUND_DEDUPE_SECONDS = int(os.getenv("OUTBOUND_DEDUPE_SECONDS", 3600))
+# DynamoDB table of claimed keys (partition key delivery_key) shared by all containers;
+# keys are only remembered per container when unset
+OUTBOUND_DEDUPE_TABLE = os.getenv("OUTBOUND_DEDUPE_TABLE")
+# How long lambda_handler waits for pending deliveries before returning
+OUTBOUND_DRAIN_TIMEOUT_SECONDS = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT_SECONDS", 10))
+
+SES_MAX_RECIPIENTS = 50
+RETRY_BACKOFF_SECONDS = 0.5
+SES_RETRY_CODES = ("Throttling", "ThrottlingException", "ServiceUnavailable", "InternalFailure")
+
+
+class RetryableError(Exception):
+    """A delivery failure that is safe to retry, e.g. throttling or a refused connection."""
+
+
+def idempotency_key(event_id=None, tool_name=None, args=None):
+    """
+    Identifies one logical send: the tool and arguments it was requested with, within the
+    event (SQS message or Step Functions task) that triggered the turn. A redelivered event
+    makes the same request again and gets the same key, even though the model issues new
+    tool call ids; the same text sent while handling a later event gets a new one.
+    Without an event id every submit is a separate send.
+    """
+    if not event_id:
+        return uuid.uuid4().hex
+    return hashlib.sha256(json.dumps([event_id, tool_name, args], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+_dedupe_table = None
+
+def _get_dedupe_table():
+    global _dedupe_table
+    if _dedupe_table is None:
+        _dedupe_table = boto3.resource("dynamodb").Table(OUTBOUND_DEDUPE_TABLE)
+    return _dedupe_table
+
+def _claim(key):
+    """
+    Records the key with a conditional write, so only one container sends it. Returns False
+    if an unexpired claim exists, and True when OUTBOUND_DEDUPE_TABLE is unset.
+    """
+    if not OUTBOUND_DEDUPE_TABLE:
+        return True
+    now = int(time.time())
+    try:
+        _get_dedupe_table().put_item(
+            Item={"delivery_key": key, "ttl": now + OUTBOUND_DEDUPE_SECONDS},
+            ConditionExpression="attribute_not_exists(delivery_key) OR #ttl < :now",
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues={":now": now},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+def _release(key):
+    """Deletes a failed delivery's claim so a retried event can send it again."""
+    if not OUTBOUND_DEDUPE_TABLE:
+        return
+    try:
+        _get_dedupe_table().delete_item(Key={"delivery_key": key})
+    except Exception as e:
+        print(f"Failed to release outbound delivery key {key}: {e}")
+
+
+class OutboundDispatcher:
+    """
+    Delivers WhatsApp and email replies from background threads, so the agent turn
+    does not wait on Meta or SES.
+
+    Emails with the same subject and body that are queued together go out as one SES
+    send with up to SES_MAX_RECIPIENTS Bcc recipients. Failed sends are retried with
+    backoff when nothing was delivered (throttling, 5xx, refused connections).
+    """
+
+    def __init__(self, workers=OUTBOUND_WORKERS):
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbound")
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._seen = OrderedDict()
+        self._pending = 0
+        self._worker = None
+        self._ses = None
+        self._metrics = {}
+
+    def submit(self, channel, payload, key=None):
+        """
+        Queues a "whatsapp" ({"to", "message"}), "email" ({"to_email", "subject", "body",
+        "is_html"}) or "raw_email" ({"to_email", "subject", "body", "attachment"}, with an
+        optional (filename, bytes) attachment) delivery and returns its idempotency key
+        without waiting for it.
+        A key already delivered or queued (see idempotency_key), by this container or by
+        another one when OUTBOUND_DEDUPE_TABLE is set, is not sent again.
+        """
+        key = key or idempotency_key()
+        with self._lock:
+            now = time.monotonic()
+            while self._seen and next(iter(self._seen.values())) < now:
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                self._count("delivery.deduplicated")
+                return key
+            self._seen[key] = now + OUTBOUND_DEDUPE_SECONDS
+
+        try:
+            claimed = _claim(key)
+        except Exception:
+            with self._lock:
+                self._seen.pop(key, None)
+            raise
+        with self._lock:
+            if not claimed:
+                self._count("delivery.deduplicated")
+                return key
+            self._pending += 1
+
+        self._queue.put({"key": key, "channel": channel, "payload": payload, "queued_at": time.monotonic()})
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="outbound-dispatch", daemon=True)
+            self._worker.start()
+        return key
+
+    def _count(self, metric, value=1, unit="Count"):
+        # Callers hold self._lock
+        unit, total = self._metrics.get(metric, (unit, 0))
+        self._metrics[metric] = (unit, total + value)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Take whatever else is already queued, so same-content emails share one send
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for group in self._group(batch):
+                self._executor.submit(self._deliver, group)
+
+    def _group(self, batch):
+        groups = []
+        emails = {}
+        for delivery in batch:
+            if delivery["channel"] != "email":
+                groups.append([delivery])
+                continue
+            payload = delivery["payload"]
+            content = (payload.get("subject"), payload.get("body"), bool(payload.get("is_html")))
+            group = emails.get(content)
+            if group is None or len(group) >= SES_MAX_RECIPIENTS:
+                group = emails[content] = []
+                groups.append(group)
+            group.append(delivery)
+        return groups
+
+    def _deliver(self, group):
+        channel = group[0]["channel"]
+        delivered = False
+        try:
+            for attempt in range(1, OUTBOUND_MAX_ATTEMPTS + 1):
+                try:
+                    self._send(channel, group)
+                    delivered = True
+                    break
+                except RetryableError as e:
+                    if attempt == OUTBOUND_MAX_ATTEMPTS:
+                        raise
+                    print(f"Outbound {channel} delivery attempt {attempt} failed, retrying: {e}")
+                    time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        except Exception as e:
+            print(f"Outbound {channel} delivery failed for {[d['key'] for d in group]}: {e}")
+        finally:
+            if not delivered:
+                for delivery in group:
+                    _release(delivery["key"])
+            finished = time.monotonic()
+            with self._lock:
+                for delivery in group:
+                    if delivered:
+                        unit, values = self._metrics.get(f"{channel}.delivery.ms", ("Milliseconds", []))
+                        values.append(round((finished - delivery["queued_at"]) * 1000, 2))
+                        self._metrics[f"{channel}.delivery.ms"] = (unit, values)
+                    else:
+                        # Let the agent resubmit a failed delivery
+                        self._seen.pop(delivery["key"], None)
+                        self._count("delivery.failed")
+                self._pending -= len(group)
+                self._idle.notify_all()
+
+    def _send(self, channel, group):
+        if channel == "whatsapp":
+            self._send_whatsapp(group[0]["payload"])
+        elif channel == "email":
+            self._send_email(group)
+        elif channel == "raw_email":
+            self._send_raw_email(group[0]["payload"])
+        else:
+            raise ValueError(f"Unsupported outbound channel: {channel}")
+
+    def _send_whatsapp(self, payload):
+        access_token = get_secret("WhatsAppAPIToken")
+        whatsapp_number_id = get_secret("WhatsappNumberID")
+        if not access_token:
+            raise Exception("Failed to retrieve access token.")
+
+        url = f"https://graph.facebook.com/v22.0/{whatsapp_number_id}/messages"
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        body = {
+            "messaging_product": "whatsapp",
+            "to": payload["to"],
+            "type": "text",
+            "text": {"body": payload["message"]}
+        }
+        try:
+            resp = http_transport.request("POST", url, headers=headers, json=body)
+        except requests.ConnectionError as e:
+            # The request never reached Meta, so sending again cannot duplicate the message
+            raise RetryableError(e)
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise RetryableError(f"WhatsApp API returned {resp.status_code} - {resp.text}")
+        if resp.status_code >= 400:
+            raise Exception(f"WhatsApp API failed: {resp.status_code} - {resp.text}")
+
+    def _send_email(self, group):
+        payload = group[0]["payload"]
+        recipients = [d["payload"]["to_email"] for d in group]
+        # Recipients of a shared send must not see each other
+        destination = {"ToAddresses": recipients} if len(recipients) == 1 else {"BccAddresses": recipients}
+        message_body = {"Html": {"Data": payload["body"]}} if payload.get("is_html") else {"Text": {"Data": payload["body"]}}
+
+        self._call_ses(
+            "send_email",
+            Source=os.getenv("EMAIL_FROM", "agent@mockify.com"),
+            Destination=destination,
+            Message={
+                "Subject": {"Data": payload.get("subject", "No Subject")},
+                "Body": message_body,
+            },
+        )
+
+    def _send_raw_email(self, payload):
+        """Sends a plain text email with an optional (filename, bytes) attachment."""
+        from_email = os.getenv("EMAIL_FROM", "agent@mockify.com")
+        message = MIMEMultipart()
+        message["Subject"] = payload.get("subject", "No Subject")
+        message["From"] = from_email
+        message["To"] = payload["to_email"]
+        message.attach(MIMEText(payload["body"], "plain"))
+        if payload.get("attachment"):
+            filename, data = payload["attachment"]
+            part = MIMEApplication(data)
+            part.add_header("Content-Disposition", "attachment", filename=filename)
+            message.attach(part)
+
+        self._call_ses(
+            "send_raw_email",
+            Source=from_email,
+            Destinations=[payload["to_email"]],
+            RawMessage={"Data": message.as_bytes()},
+        )
+
+    def _call_ses(self, operation, **kwargs):
+        if self._ses is None:
+            self._ses = boto3.client("ses")
+        try:
+            return getattr(self._ses, operation)(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in SES_RETRY_CODES:
+                raise RetryableError(e)
+            raise
+        except EndpointConnectionError as e:
+            raise RetryableError(e)
+
+    def drain(self, timeout=OUTBOUND_DRAIN_TIMEOUT_SECONDS):
+        """
+        Waits for queued deliveries to finish, then emits their latency metrics.
+        Returns False if some were still pending at the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._pending and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+            pending = self._pending
+            metrics, self._metrics = self._metrics, {}
+        if pending:
+            print(f"{pending} outbound deliveries still pending after {timeout}s")
+            metrics["delivery.pending"] = ("Count", pending)
+        emit_metrics("outbound", metrics)
+        return not pending
+
+
+class InMemoryDispatcher:
+    """Stand-in for OutboundDispatcher that records deliveries instead of sending them."""
+
+    def __init__(self):
+        self.sent = []
+        self._keys = set()
+
+    def submit(self, channel, payload, key=None):
+        key = key or idempotency_key()
+        if key not in self._keys:
+            self._keys.add(key)
+            self.sent.append({"key": key, "channel": channel, "payload": payload})
+        return key
+
+    def drain(self, timeout=None):
+        return True
+
+
+_dispatcher = None
+
+def get_dispatcher():
+    """Returns the container's dispatcher, created on first use."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+def set_dispatcher(dispatcher):
+    """Replaces the dispatcher, e.g. with InMemoryDispatcher in tests and benchmarks."""
+    global _dispatcher
+    _dispatcher = dispatcher
+
+def drain():
+    """Waits for pending deliveries; a no-op if nothing was ever sent in this container."""
+    if _dispatcher is not None:
+        return _dispatcher.drain()
+    return True
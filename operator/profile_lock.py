@@ -0,0 +1,68 @@
+# profile_lock.py
+import os
+import time
+import uuid
+import boto3
+from botocore.exceptions import ClientError
+from tracing import span
+
+# DynamoDB table holding per-profile leases (partition key profile_id); locking is off when unset
+PROFILE_LOCK_TABLE = os.getenv("PROFILE_LOCK_TABLE")
+# Should exceed the Lambda timeout, so a crashed invocation's lease expires on its own
+PROFILE_LOCK_LEASE_SECONDS = int(os.getenv("PROFILE_LOCK_LEASE_SECONDS", 90))
+
+_table = None
+
+
+class LeaseHeld(Exception):
+    """Another invocation is running a turn for this profile."""
+
+
+def _get_table():
+    global _table
+    if _table is None:
+        _table = boto3.resource("dynamodb").Table(PROFILE_LOCK_TABLE)
+    return _table
+
+
+def acquire(profile_id):
+    """
+    Takes the profile's lease with a conditional write and returns its owner token,
+    or None when PROFILE_LOCK_TABLE is unset.
+
+    Raises:
+        LeaseHeld: If an unexpired lease is held by another owner.
+    """
+    if not PROFILE_LOCK_TABLE:
+        return None
+    owner = uuid.uuid4().hex
+    now = int(time.time())
+    try:
+        with span("lock.acquire"):
+            _get_table().put_item(
+                Item={"profile_id": profile_id, "owner": owner, "expires_at": now + PROFILE_LOCK_LEASE_SECONDS, "ttl": now + PROFILE_LOCK_LEASE_SECONDS * 2},
+                ConditionExpression="attribute_not_exists(profile_id) OR expires_at < :now",
+                ExpressionAttributeValues={":now": now},
+            )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise LeaseHeld(f"Profile {profile_id} is locked by another invocation")
+        raise
+    return owner
+
+
+def release(profile_id, owner):
+    """Deletes the lease if it is still ours; an expired and re-taken lease is left alone."""
+    if owner is None:
+        return
+    try:
+        _get_table().delete_item(
+            Key={"profile_id": profile_id},
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={":owner": owner},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
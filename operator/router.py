@@ -0,0 +1,60 @@
+# router.py
+import os
+from sf_credentials import session_status, oauth_authorize_url
+from tracing import span
+
+# Set to n to send every message through the agent graph
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "y").lower() == "y"
+
+LOGIN_MESSAGES = {
+    "missing": "Please log in to Salesforce to continue: {url}",
+    "expired": "Your Salesforce session has expired. Please log in again: {url}",
+}
+
+_rules = []
+
+
+def rule(fn):
+    """
+    Registers a routing rule. A rule takes the request dict (channel_type, recipient,
+    profile_id, message) and returns a {"nextagent", "message"} reply, or None to pass.
+    Rules are tried in registration order.
+    """
+    _rules.append(fn)
+    return fn
+
+
+def route(request):
+    """
+    Returns the reply of the first matching rule, or None if the agent graph should run.
+    A rule that raises is logged and skipped, so a shortcut never fails the turn.
+    """
+    if not ROUTER_ENABLED:
+        return None
+    for fn in _rules:
+        with span("router", rule=fn.__name__) as attrs:
+            try:
+                reply = fn(request)
+            except Exception as e:
+                print(f"Routing rule {fn.__name__} failed, leaving the message to the agent: {e}")
+                attrs["error"] = type(e).__name__
+                reply = None
+            attrs["matched"] = reply is not None
+        if reply is not None:
+            print(f"Routed message from {request['recipient']} by rule {fn.__name__}")
+            return reply
+    return None
+
+
+@rule
+def salesforce_login(request):
+    """Answers with the login URL when the profile has no usable Salesforce session."""
+    status = session_status(request["profile_id"])
+    if status == "active":
+        return None
+    try:
+        url = oauth_authorize_url(request["profile_id"])
+    except ValueError as e:
+        print(f"Cannot build Salesforce login URL, leaving it to the agent: {e}")
+        return None
+    return {"nextagent": "comms-agent", "message": LOGIN_MESSAGES[status].format(url=url)}
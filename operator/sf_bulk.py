@@ -0,0 +1,122 @@
+# sf_bulk.py
+import os
+import time
+import tempfile
+from sf_credentials import sf_request
+
+# Polling starts fast for small jobs and backs off for long ones
+BULK_POLL_INITIAL_SECONDS = float(os.getenv("BULK_POLL_INITIAL_SECONDS", 0.5))
+BULK_POLL_MAX_SECONDS = float(os.getenv("BULK_POLL_MAX_SECONDS", 5))
+# Should leave room within the Lambda timeout to send the result
+BULK_JOB_TIMEOUT_SECONDS = float(os.getenv("BULK_JOB_TIMEOUT_SECONDS", 40))
+BULK_MAX_RECORDS_PER_PAGE = int(os.getenv("BULK_MAX_RECORDS_PER_PAGE", 50000))
+# Results larger than this spill from memory to a temporary file
+BULK_SPOOL_MEMORY_BYTES = int(os.getenv("BULK_SPOOL_MEMORY_BYTES", 5 * 1024 * 1024))
+
+CHUNK_BYTES = 64 * 1024
+TERMINAL_STATES = ("JobComplete", "Failed", "Aborted")
+
+
+def _jobs_path(*parts):
+    api_version = os.getenv("SF_API_VERSION", "v60.0")
+    return "/".join([f"/services/data/{api_version}/jobs/query", *parts])
+
+
+def create_query_job(profile_id, soql_query):
+    """Starts a Bulk API 2.0 query job and returns its id."""
+    resp = sf_request(profile_id, "POST", _jobs_path(), json={"operation": "query", "query": soql_query})
+    if resp.status_code not in (200, 201):
+        raise Exception(f"Salesforce bulk query failed: {resp.status_code} - {resp.text}")
+    return resp.json()["id"]
+
+
+def wait_for_job(profile_id, job_id, timeout=BULK_JOB_TIMEOUT_SECONDS):
+    """
+    Polls the job with exponential backoff until it reaches a terminal state
+    or timeout seconds pass.
+
+    Returns:
+        dict: The job info. Its state is JobComplete, Failed or Aborted, or the
+        running state (e.g. InProgress) if the job did not finish in time.
+    """
+    deadline = time.monotonic() + timeout
+    delay = BULK_POLL_INITIAL_SECONDS
+    while True:
+        resp = sf_request(profile_id, "GET", _jobs_path(job_id))
+        if resp.status_code != 200:
+            raise Exception(f"Salesforce bulk job status failed: {resp.status_code} - {resp.text}")
+        job = resp.json()
+        if job["state"] in TERMINAL_STATES:
+            return job
+        if time.monotonic() + delay > deadline:
+            print(f"Bulk query job {job_id} still {job['state']} after {timeout:.1f}s")
+            return job
+        time.sleep(delay)
+        delay = min(delay * 2, BULK_POLL_MAX_SECONDS)
+
+
+def abort_job(profile_id, job_id):
+    """Aborts a running job so Salesforce stops processing a result nobody will collect."""
+    resp = sf_request(profile_id, "PATCH", _jobs_path(job_id), json={"state": "Aborted"})
+    if resp.status_code != 200:
+        # e.g. the job finished in the meantime
+        print(f"Could not abort bulk query job {job_id}: {resp.status_code} - {resp.text}")
+        return None
+    return resp.json()
+
+
+def iter_result_chunks(profile_id, job_id):
+    """
+    Yields the job's CSV result as byte chunks, following Sforce-Locator across pages.
+    The header row is yielded once; later pages have theirs stripped.
+    """
+    locator = None
+    first_page = True
+    while True:
+        params = {"maxRecords": BULK_MAX_RECORDS_PER_PAGE}
+        if locator:
+            params["locator"] = locator
+        resp = sf_request(profile_id, "GET", _jobs_path(job_id, "results"), headers={"Accept": "text/csv"}, params=params, stream=True)
+        try:
+            if resp.status_code != 200:
+                raise Exception(f"Salesforce bulk results failed: {resp.status_code} - {resp.text}")
+            skip_header = not first_page
+            for chunk in resp.iter_content(CHUNK_BYTES):
+                if skip_header:
+                    newline = chunk.find(b"\n")
+                    if newline < 0:
+                        continue
+                    chunk, skip_header = chunk[newline + 1:], False
+                if chunk:
+                    yield chunk
+            locator = resp.headers.get("Sforce-Locator")
+        finally:
+            resp.close()
+        first_page = False
+        if not locator or locator == "null":
+            return
+
+
+def export_query(profile_id, soql_query, timeout=BULK_JOB_TIMEOUT_SECONDS):
+    """
+    Runs a bulk query and spools its CSV result, waiting at most timeout seconds for the job.
+    A job still running at the timeout is aborted and its info gets "timed_out": True.
+
+    Returns:
+        tuple: (job info dict, spooled file positioned at the start, size in bytes).
+        The caller closes the file. If the job did not complete, the file is empty.
+    """
+    job_id = create_query_job(profile_id, soql_query)
+    job = wait_for_job(profile_id, job_id, timeout)
+    if job["state"] not in TERMINAL_STATES:
+        aborted = abort_job(profile_id, job_id)
+        # If the abort was refused the job may just have finished, so look once more
+        job = dict(aborted, timed_out=True) if aborted else wait_for_job(profile_id, job_id, 0)
+    spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MEMORY_BYTES)
+    size = 0
+    if job["state"] == "JobComplete":
+        for chunk in iter_result_chunks(profile_id, job_id):
+            spool.write(chunk)
+            size += len(chunk)
+    spool.seek(0)
+    return job, spool, size
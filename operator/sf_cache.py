@@ -0,0 +1,102 @@
+# sf_cache.py
+import os
+import re
+import time
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+SF_CACHE_TTL_SECONDS = int(os.getenv("SF_CACHE_TTL_SECONDS", 120))
+SF_CACHE_MAX_ENTRIES = int(os.getenv("SF_CACHE_MAX_ENTRIES", 256))
+
+FROM_PATTERN = re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE)
+RELATIONSHIP_PATTERN = re.compile(r"\b(\w+)\.\w+")
+
+
+def normalize_soql(soql_query):
+    return " ".join(soql_query.split())
+
+
+def soql_objects(soql_query):
+    """Returns lower-cased sObject and relationship names a SOQL query reads from."""
+    names = set(FROM_PATTERN.findall(soql_query)) | set(RELATIONSHIP_PATTERN.findall(soql_query))
+    return {name.lower() for name in names}
+
+
+def rest_path_objects(path):
+    """Returns lower-cased sObject names a REST GET path reads from."""
+    parsed = urllib.parse.urlsplit(path)
+    query = urllib.parse.parse_qs(parsed.query).get("q")
+    if query:
+        return soql_objects(query[0])
+    segments = [s for s in parsed.path.split("/") if s]
+    if "sobjects" in segments:
+        following = segments[segments.index("sobjects") + 1:]
+        return {following[0].lower()} if following else set()
+    return {s.lower() for s in segments}
+
+
+class ReadCache:
+    """
+    Per-profile TTL/LRU cache for Salesforce reads.
+
+    Each entry remembers the sObjects it depends on, so a write to an sObject
+    drops that profile's entries which read from it.
+    """
+
+    def __init__(self, ttl_seconds=SF_CACHE_TTL_SECONDS, max_entries=SF_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, profile_id, key):
+        """Returns the cached value, or None on a miss."""
+        if self.ttl_seconds <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get((str(profile_id), key))
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end((str(profile_id), key))
+            self.hits += 1
+            return entry[2]
+
+    def put(self, profile_id, key, value, objects):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[(str(profile_id), key)] = (time.monotonic() + self.ttl_seconds, objects, value)
+            self._entries.move_to_end((str(profile_id), key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, profile_id, object_type):
+        """Drops the profile's entries that read from object_type."""
+        object_type = object_type.lower()
+        with self._lock:
+            stale = [
+                key for key, (_, objects, _) in self._entries.items()
+                if key[0] == str(profile_id) and object_type in objects
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+        }
+
+
+read_cache = ReadCache()
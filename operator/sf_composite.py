@@ -0,0 +1,150 @@
+# sf_composite.py
+import os
+import re
+import json
+from sf_credentials import sf_request
+
+# Salesforce API limits per request
+COMPOSITE_MAX_SUBREQUESTS = 25
+COLLECTIONS_MAX_RECORDS = 200
+
+REFERENCE_PATTERN = re.compile(r"@\{(\w+)[.\[]")
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _check_response(resp):
+    if resp.status_code not in (200, 201):
+        raise Exception(f"Salesforce API failed: {resp.status_code} - {resp.text}")
+    return resp.json()
+
+
+def _validate(operations):
+    for index, op in enumerate(operations):
+        operation = op.get("operation")
+        if operation not in ("create", "update", "get"):
+            raise ValueError(f"Unsupported operation at index {index}: {operation}")
+        if not op.get("object_type"):
+            raise ValueError(f"object_type is required at index {index}.")
+        if operation == "update" and not op.get("record_id"):
+            raise ValueError(f"record_id is required for update at index {index}.")
+
+
+def _subrequest(op, index, api_version):
+    base = f"/services/data/{api_version}"
+    operation = op["operation"]
+    object_type = op["object_type"]
+    if operation == "create":
+        request = {"method": "POST", "url": f"{base}/sobjects/{object_type}", "body": op.get("data") or {}}
+    elif operation == "update":
+        request = {"method": "PATCH", "url": f"{base}/sobjects/{object_type}/{op['record_id']}", "body": op.get("data") or {}}
+    else:
+        request = {"method": "GET", "url": f"{base}/{object_type}"}
+    request["referenceId"] = op.get("reference_id") or f"op{index}"
+    return request
+
+
+def _run_composite(profile_id, indexed_ops, all_or_none, api_version):
+    """Runs operations through the Composite API, 25 subrequests per call."""
+    results = {}
+    for chunk in _chunks(indexed_ops, COMPOSITE_MAX_SUBREQUESTS):
+        subrequests = [_subrequest(op, index, api_version) for index, op in chunk]
+
+        # References can only point to earlier subrequests of the same composite call
+        known = set()
+        for subrequest in subrequests:
+            for ref in REFERENCE_PATTERN.findall(json.dumps(subrequest)):
+                if ref not in known:
+                    raise ValueError(
+                        f"Reference '{ref}' must point to an earlier operation within the same "
+                        f"group of {COMPOSITE_MAX_SUBREQUESTS} operations."
+                    )
+            known.add(subrequest["referenceId"])
+
+        resp = sf_request(
+            profile_id, "POST", f"/services/data/{api_version}/composite",
+            json={"allOrNone": all_or_none, "compositeRequest": subrequests},
+        )
+        responses = _check_response(resp).get("compositeResponse", [])
+        created = {}
+        for (index, op), subrequest, sub_response in zip(chunk, subrequests, responses):
+            status = sub_response.get("httpStatusCode")
+            body = sub_response.get("body")
+            result = {"index": index, "reference_id": subrequest["referenceId"], "success": status in (200, 201, 204), "status": status}
+            if not result["success"]:
+                result["errors"] = body
+            elif isinstance(body, dict) and "id" in body and subrequest["method"] == "POST":
+                result["id"] = created[subrequest["referenceId"]] = body["id"]
+            elif subrequest["method"] == "PATCH":
+                # Updates answer 204 with no body; a "@{ref.id}" record_id resolves to the earlier create
+                ref = REFERENCE_PATTERN.match(op["record_id"])
+                result["id"] = created.get(ref.group(1), op["record_id"]) if ref else op["record_id"]
+            elif subrequest["method"] == "GET":
+                result["body"] = body
+            results[index] = result
+    return results
+
+
+def _run_collection(profile_id, indexed_ops, method, all_or_none, api_version):
+    """Runs creates (POST) or updates (PATCH) through sObject Collections, 200 records per call."""
+    results = {}
+    for chunk in _chunks(indexed_ops, COLLECTIONS_MAX_RECORDS):
+        records = []
+        for _, op in chunk:
+            record = {"attributes": {"type": op["object_type"]}}
+            record.update(op.get("data") or {})
+            if method == "PATCH":
+                record["id"] = op["record_id"]
+            records.append(record)
+
+        resp = sf_request(
+            profile_id, method, f"/services/data/{api_version}/composite/sobjects",
+            json={"allOrNone": all_or_none, "records": records},
+        )
+        for (index, op), item in zip(chunk, _check_response(resp)):
+            result = {"index": index, "reference_id": op.get("reference_id") or f"op{index}", "success": item.get("success", False), "id": item.get("id")}
+            if item.get("errors"):
+                result["errors"] = item["errors"]
+            results[index] = result
+    return results
+
+
+def run_operations(profile_id, operations, all_or_none=False):
+    """
+    Runs several create/update/get operations in as few Salesforce calls as possible.
+
+    Batches of only creates or only updates without references use sObject Collections.
+    Anything else goes through the Composite API in input order, so a later operation
+    sees the effects of earlier ones. With all_or_none the whole input must fit in one
+    call (COMPOSITE_MAX_SUBREQUESTS, or COLLECTIONS_MAX_RECORDS for collections),
+    since Salesforce cannot roll back across calls.
+
+    Returns:
+        list[dict]: One result per operation, in input order.
+
+    Raises:
+        ValueError: If an operation is invalid, or all_or_none is set for more
+            operations than fit in one call.
+    """
+    _validate(operations)
+    api_version = os.getenv("SF_API_VERSION", "v60.0")
+    indexed_ops = list(enumerate(operations))
+    kinds = {op["operation"] for op in operations}
+
+    if len(kinds) == 1 and kinds <= {"create", "update"} and not REFERENCE_PATTERN.search(json.dumps(operations)):
+        if all_or_none and len(operations) > COLLECTIONS_MAX_RECORDS:
+            raise ValueError(f"all_or_none supports at most {COLLECTIONS_MAX_RECORDS} operations per call.")
+        method = "POST" if kinds == {"create"} else "PATCH"
+        results = _run_collection(profile_id, indexed_ops, method, all_or_none, api_version)
+    else:
+        if all_or_none and len(operations) > COMPOSITE_MAX_SUBREQUESTS:
+            raise ValueError(
+                f"all_or_none supports at most {COMPOSITE_MAX_SUBREQUESTS} operations per call "
+                f"when they mix operation types, use references, or include gets."
+            )
+        results = _run_composite(profile_id, indexed_ops, all_or_none, api_version)
+
+    return [results.get(index, {"index": index, "success": False, "errors": "No response from Salesforce"}) for index, _ in indexed_ops]
@@ -0,0 +1,194 @@
+# sf_credentials.py
+import os
+import time
+import asyncio
+import threading
+import urllib.parse
+import boto3
+import http_transport
+
+# How long credentials read from DynamoDB are reused before being read again
+SF_CREDENTIALS_TTL_SECONDS = int(os.getenv("SF_CREDENTIALS_TTL_SECONDS", 300))
+# Age after which an access token without a refresh_token is treated as expired, 0 to never expire
+SF_SESSION_MAX_AGE_SECONDS = int(os.getenv("SF_SESSION_MAX_AGE_SECONDS", 0))
+
+dynamodb = boto3.resource("dynamodb")
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _table():
+    table_name = os.getenv("SF_DDB_TABLE")
+    if not table_name:
+        raise EnvironmentError("Missing SF_DDB_TABLE in environment variables.")
+    return dynamodb.Table(table_name)
+
+
+def get_credentials(profile_id):
+    """
+    Returns the stored Salesforce credentials for a profile, cached in-process.
+
+    Returns:
+        dict: DynamoDB item with at least access_token and instance_url.
+
+    Raises:
+        Exception: If no record exists or it lacks access_token/instance_url.
+    """
+    profile_id = str(profile_id)
+    cached = _cache.get(profile_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    response = _table().get_item(Key={"wa_id": profile_id})
+    if "Item" not in response:
+        raise Exception(f"No record found in DynamoDB for wa_id: {profile_id}")
+
+    item = response["Item"]
+    if not item.get("access_token") or not item.get("instance_url"):
+        raise Exception(f"Missing access_token or instance_url for wa_id: {profile_id}")
+
+    _cache[profile_id] = (time.monotonic() + SF_CREDENTIALS_TTL_SECONDS, item)
+    return item
+
+
+def session_status(profile_id):
+    """
+    Returns "active", "missing" or "expired" for the profile's stored Salesforce session.
+
+    A token with a refresh_token is active, since sf_request() refreshes it on demand.
+    """
+    profile_id = str(profile_id)
+    cached = _cache.get(profile_id)
+    if cached and cached[0] > time.monotonic():
+        item = cached[1]
+    else:
+        item = _table().get_item(Key={"wa_id": profile_id}).get("Item")
+        if not item or not item.get("access_token") or not item.get("instance_url"):
+            return "missing"
+        _cache[profile_id] = (time.monotonic() + SF_CREDENTIALS_TTL_SECONDS, item)
+
+    if item.get("refresh_token") or not SF_SESSION_MAX_AGE_SECONDS or not item.get("issued_at"):
+        return "active"
+    age = time.time() - int(item["issued_at"]) / 1000
+    return "expired" if age > SF_SESSION_MAX_AGE_SECONDS else "active"
+
+
+def oauth_authorize_url(profile_id):
+    """
+    Builds the Salesforce OAuth2 authorization URL for a profile.
+
+    Raises:
+        ValueError: If SALESFORCE_DOMAIN, SALESFORCE_CLIENT_ID or SALESFORCE_REDIRECT_URI is unset.
+    """
+    domain = os.environ.get("SALESFORCE_DOMAIN")
+    client_id = os.environ.get("SALESFORCE_CLIENT_ID")
+    redirect_uri = os.environ.get("SALESFORCE_REDIRECT_URI")
+
+    if not all([domain, client_id, redirect_uri]):
+        raise ValueError("Missing required environment variables.")
+
+    base_url = f"https://{domain}/services/oauth2/authorize"
+    query_params = {
+        "response_type": "code",
+        "client_id": client_id,
+        "redirect_uri": redirect_uri,
+        "scope": "api",
+        "state": f"profile:{profile_id}"
+    }
+
+    return f"{base_url}?{urllib.parse.urlencode(query_params)}"
+
+
+def invalidate_credentials(profile_id):
+    _cache.pop(str(profile_id), None)
+
+
+def refresh_credentials(profile_id, expired_token):
+    """
+    Exchanges the stored refresh_token for a new access token and writes it back.
+
+    If another caller already refreshed past expired_token, the cached credentials
+    are returned without another token request.
+    """
+    profile_id = str(profile_id)
+    with _lock:
+        invalidate_credentials(profile_id)
+        item = get_credentials(profile_id)
+        if item["access_token"] != expired_token:
+            return item
+
+        refresh_token = item.get("refresh_token")
+        domain = os.environ.get("SALESFORCE_DOMAIN")
+        client_id = os.environ.get("SALESFORCE_CLIENT_ID")
+        if not all([refresh_token, domain, client_id]):
+            raise Exception(f"Salesforce session expired and cannot be refreshed for wa_id: {profile_id}")
+
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": client_id,
+        }
+        client_secret = os.environ.get("SALESFORCE_CLIENT_SECRET")
+        if client_secret:
+            data["client_secret"] = client_secret
+
+        resp = http_transport.request("POST", f"https://{domain}/services/oauth2/token", data=data)
+        if resp.status_code != 200:
+            raise Exception(f"Salesforce token refresh failed: {resp.status_code} - {resp.text}")
+
+        token = resp.json()
+        item = dict(item)
+        item["access_token"] = token["access_token"]
+        item["instance_url"] = token.get("instance_url", item["instance_url"])
+        if token.get("issued_at"):
+            item["issued_at"] = int(token["issued_at"])
+
+        _table().update_item(
+            Key={"wa_id": profile_id},
+            UpdateExpression="SET access_token = :at, instance_url = :iu, issued_at = :ia",
+            ExpressionAttributeValues={
+                ":at": item["access_token"],
+                ":iu": item["instance_url"],
+                ":ia": item.get("issued_at", int(time.time() * 1000)),
+            },
+        )
+        _cache[profile_id] = (time.monotonic() + SF_CREDENTIALS_TTL_SECONDS, item)
+        return item
+
+
+def _request_target(item, path, headers):
+    url = path if path.startswith("https://") else f"{item['instance_url']}{path}"
+    request_headers = {
+        "Authorization": f"Bearer {item['access_token']}",
+        "Content-Type": "application/json",
+    }
+    request_headers.update(headers or {})
+    return url, request_headers
+
+
+def sf_request(profile_id, method, path, headers=None, **kwargs):
+    """
+    Sends an authenticated request to the profile's Salesforce instance.
+
+    path is relative to instance_url (e.g. "/services/data/v60.0/query") or absolute.
+    On a 401 the access token is refreshed once and the request retried.
+    """
+    item = get_credentials(profile_id)
+    for attempt in range(2):
+        url, request_headers = _request_target(item, path, headers)
+        resp = http_transport.request(method, url, headers=request_headers, **kwargs)
+        if resp.status_code != 401 or attempt:
+            return resp
+        item = refresh_credentials(profile_id, item["access_token"])
+
+
+async def asf_request(profile_id, method, path, headers=None, **kwargs):
+    """Async counterpart of sf_request(); DynamoDB and token refresh run in a worker thread."""
+    item = await asyncio.to_thread(get_credentials, profile_id)
+    for attempt in range(2):
+        url, request_headers = _request_target(item, path, headers)
+        resp = await http_transport.arequest(method, url, headers=request_headers, **kwargs)
+        if resp.status_code != 401 or attempt:
+            return resp
+        item = await asyncio.to_thread(refresh_credentials, profile_id, item["access_token"])
@@ -0,0 +1,162 @@
+# sf_schema.py
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from sf_credentials import get_credentials, sf_request, asf_request
+
+# Describes younger than this are used without asking Salesforce; older ones are revalidated
+SF_SCHEMA_TTL_SECONDS = int(os.getenv("SF_SCHEMA_TTL_SECONDS", 3600))
+SF_SCHEMA_MAX_OBJECTS = int(os.getenv("SF_SCHEMA_MAX_OBJECTS", 200))
+# Fields returned when no keyword narrows the describe
+SF_SCHEMA_MAX_FIELDS = int(os.getenv("SF_SCHEMA_MAX_FIELDS", 60))
+
+PICKLIST_MAX_VALUES = 15
+FIELD_COLUMNS = ["name", "type", "label", "reference_to", "relationship_name"]
+
+
+def _describe_path(object_type):
+    api_version = os.getenv("SF_API_VERSION", "v60.0")
+    return f"/services/data/{api_version}/sobjects/{object_type}/describe"
+
+
+def compact_describe(describe):
+    """Keeps the parts of an sObject describe needed to write SOQL and REST calls."""
+    fields = []
+    picklists = {}
+    for field in describe.get("fields", []):
+        fields.append([
+            field["name"],
+            field["type"],
+            field.get("label"),
+            ",".join(field.get("referenceTo") or []) or None,
+            field.get("relationshipName"),
+        ])
+        if field["type"] in ("picklist", "multipicklist"):
+            values = [v["value"] for v in field.get("picklistValues", []) if v.get("active", True)]
+            picklists[field["name"]] = values[:PICKLIST_MAX_VALUES]
+
+    return {
+        "object": describe.get("name"),
+        "label": describe.get("label"),
+        "fields": fields,
+        "picklists": picklists,
+        "child_relationships": [
+            [child["relationshipName"], child["childSObject"], child["field"]]
+            for child in describe.get("childRelationships", [])
+            if child.get("relationshipName")
+        ],
+    }
+
+
+def select_fields(schema, keywords=None):
+    """
+    Narrows a compact describe to fields and child relationships matching any keyword
+    (case-insensitive, on name or label). Id and Name are always included.
+    """
+    terms = [k.lower() for k in (keywords or []) if k]
+
+    def matches(*values):
+        return any(term in (value or "").lower() for term in terms for value in values)
+
+    if terms:
+        fields = [f for f in schema["fields"] if f[0] in ("Id", "Name") or matches(f[0], f[2], f[4])]
+        children = [c for c in schema["child_relationships"] if matches(c[0], c[1])]
+    else:
+        fields = schema["fields"][:SF_SCHEMA_MAX_FIELDS]
+        children = schema["child_relationships"][:SF_SCHEMA_MAX_FIELDS]
+
+    names = {f[0] for f in fields}
+    return {
+        "object": schema["object"],
+        "label": schema["label"],
+        "total_fields": len(schema["fields"]),
+        "columns": FIELD_COLUMNS,
+        "fields": fields,
+        "picklists": {name: values for name, values in schema["picklists"].items() if name in names},
+        "child_relationships": children,
+        "truncated": len(fields) < len(schema["fields"]) and not terms,
+    }
+
+
+class SchemaIndex:
+    """
+    Compact sObject describes per Salesforce org, keyed by instance_url.
+
+    Entries older than SF_SCHEMA_TTL_SECONDS are revalidated with If-None-Match /
+    If-Modified-Since, and a 304 keeps the cached describe.
+    """
+
+    def __init__(self, ttl_seconds=SF_SCHEMA_TTL_SECONDS, max_objects=SF_SCHEMA_MAX_OBJECTS):
+        self.ttl_seconds = ttl_seconds
+        self.max_objects = max_objects
+        self.hits = 0
+        self.revalidated = 0
+        self.fetched = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, profile_id, object_type):
+        """Returns (key, entry, fresh) for the profile's org and object."""
+        key = (get_credentials(profile_id)["instance_url"], object_type.lower())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+        fresh = entry is not None and entry["checked_at"] + self.ttl_seconds > time.monotonic()
+        return key, entry, fresh
+
+    def _conditional_headers(self, entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _store(self, key, entry, resp, object_type):
+        if resp.status_code == 304 and entry:
+            self.revalidated += 1
+            entry["checked_at"] = time.monotonic()
+            return entry["schema"]
+        if resp.status_code != 200:
+            raise Exception(f"Salesforce describe of {object_type} failed: {resp.status_code} - {resp.text}")
+
+        self.fetched += 1
+        entry = {
+            "schema": compact_describe(resp.json()),
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "checked_at": time.monotonic(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_objects:
+                self._entries.popitem(last=False)
+        return entry["schema"]
+
+    def describe(self, profile_id, object_type):
+        """Returns the compact describe of object_type in the profile's org."""
+        key, entry, fresh = self._lookup(profile_id, object_type)
+        if fresh:
+            self.hits += 1
+            return entry["schema"]
+        resp = sf_request(profile_id, "GET", _describe_path(object_type), headers=self._conditional_headers(entry))
+        return self._store(key, entry, resp, object_type)
+
+    async def adescribe(self, profile_id, object_type):
+        """Async counterpart of describe()."""
+        key, entry, fresh = await asyncio.to_thread(self._lookup, profile_id, object_type)
+        if fresh:
+            self.hits += 1
+            return entry["schema"]
+        resp = await asf_request(profile_id, "GET", _describe_path(object_type), headers=self._conditional_headers(entry))
+        return self._store(key, entry, resp, object_type)
+
+    def stats(self):
+        return {"hits": self.hits, "revalidated": self.revalidated, "fetched": self.fetched, "size": len(self._entries)}
+
+
+schema_index = SchemaIndex()
@@ -0,0 +1,136 @@
+# sf_soql.py
+import os
+import json
+from sf_credentials import sf_request, asf_request
+
+# Budget for rows handed back to the agent; pages beyond it are never fetched
+SOQL_MAX_ROWS = int(os.getenv("SOQL_MAX_ROWS", 200))
+SOQL_MAX_BYTES = int(os.getenv("SOQL_MAX_BYTES", 40000))
+
+
+def _query_path():
+    api_version = os.getenv("SF_API_VERSION", "v60.0")
+    return f"/services/data/{api_version}/query"
+
+
+def _parse_page(resp):
+    """Returns (page, nextRecordsUrl or None) for a query response."""
+    if resp.status_code != 200:
+        raise Exception(f"Salesforce query failed: {resp.status_code} - {resp.text}")
+    page = resp.json()
+    next_url = page.get("nextRecordsUrl")
+    return page, None if page.get("done", True) else next_url
+
+
+def iter_query_pages(profile_id, soql_query):
+    """Yields SOQL result pages, requesting nextRecordsUrl only when the next page is consumed."""
+    resp = sf_request(profile_id, "GET", _query_path(), params={"q": soql_query})
+    while True:
+        page, next_url = _parse_page(resp)
+        yield page
+        if not next_url:
+            return
+        resp = sf_request(profile_id, "GET", next_url)
+
+
+async def aiter_query_pages(profile_id, soql_query):
+    """Async counterpart of iter_query_pages()."""
+    resp = await asf_request(profile_id, "GET", _query_path(), params={"q": soql_query})
+    while True:
+        page, next_url = _parse_page(resp)
+        yield page
+        if not next_url:
+            return
+        resp = await asf_request(profile_id, "GET", next_url)
+
+
+def flatten_record(record, prefix=""):
+    """
+    Drops "attributes" metadata and flattens parent relationships into dotted keys,
+    e.g. {"Account": {"Name": "Acme"}} becomes {"Account.Name": "Acme"}.
+    Child subquery results are kept as nested compact tables.
+    """
+    flat = {}
+    for key, value in record.items():
+        if key == "attributes":
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and "records" in value:
+            flat[name] = compact_records(value.get("records", []), value.get("totalSize"))
+        elif isinstance(value, dict):
+            flat.update(flatten_record(value, prefix=f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def compact_records(records, total_size=None):
+    """Encodes records as {"columns": [...], "rows": [[...], ...]} with column names listed once."""
+    flat_records = [flatten_record(r) for r in records]
+    columns = []
+    for flat in flat_records:
+        for key in flat:
+            if key not in columns:
+                columns.append(key)
+    return {
+        "totalSize": len(records) if total_size is None else total_size,
+        "columns": columns,
+        "rows": [[flat.get(c) for c in columns] for flat in flat_records],
+    }
+
+
+class _QueryBudget:
+    """Collects records from successive pages until the row or byte budget is reached."""
+
+    def __init__(self, max_rows, max_bytes):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.records = []
+        self.used_bytes = 0
+        self.total_size = 0
+        self.truncated = False
+
+    def add_page(self, page):
+        """Adds a page's records; returns False once the budget is exhausted."""
+        self.total_size = page.get("totalSize", self.total_size)
+        for record in page.get("records", []):
+            record_bytes = len(json.dumps(flatten_record(record), default=str))
+            if len(self.records) >= self.max_rows or self.used_bytes + record_bytes > self.max_bytes:
+                self.truncated = True
+                return False
+            self.records.append(record)
+            self.used_bytes += record_bytes
+        if len(self.records) >= self.max_rows and not page.get("done", True):
+            # Budget is full; report truncation without fetching the next page
+            self.truncated = True
+            return False
+        return True
+
+    def result(self):
+        result = compact_records(self.records, self.total_size)
+        result["truncated"] = self.truncated
+        return result
+
+
+def run_query(profile_id, soql_query, max_rows=SOQL_MAX_ROWS, max_bytes=SOQL_MAX_BYTES):
+    """
+    Runs a SOQL query, paging lazily until the row or byte budget is reached.
+
+    Returns:
+        dict: {"totalSize", "columns", "rows", "truncated"}. truncated is True when
+        more matching records exist than were returned.
+    """
+    budget = _QueryBudget(max_rows, max_bytes)
+    for page in iter_query_pages(profile_id, soql_query):
+        if not budget.add_page(page):
+            break
+    return budget.result()
+
+
+async def arun_query(profile_id, soql_query, max_rows=SOQL_MAX_ROWS, max_bytes=SOQL_MAX_BYTES):
+    """Async counterpart of run_query()."""
+    budget = _QueryBudget(max_rows, max_bytes)
+    async for page in aiter_query_pages(profile_id, soql_query):
+        if not budget.add_page(page):
+            break
+    return budget.result()
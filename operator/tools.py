@@ -1,11 +1,19 @@
 import os
-import urllib.parse
-import requests
+import asyncio
 from langchain_core.tools import tool
-from utils import get_secret
-import boto3
+from outbound import get_dispatcher, idempotency_key
+from sf_credentials import sf_request, asf_request, oauth_authorize_url
+from sf_soql import run_query, arun_query
+from sf_composite import run_operations
+from sf_cache import read_cache, normalize_soql, soql_objects, rest_path_objects
+from sf_schema import schema_index, select_fields
+from sf_bulk import export_query, BULK_JOB_TIMEOUT_SECONDS
 import json
+import gzip
+import shutil
+import tempfile
 from typing import Optional, Literal
+from langchain_core.runnables import RunnableConfig
 
 
 @tool
@@ -24,27 +32,11 @@ def generate_salesforce_oauth_url(profile_id: str) -> str:
     Returns:
         str: Complete Salesforce OAuth2 URL.
     """
-    domain = os.environ.get("SALESFORCE_DOMAIN")
-    client_id = os.environ.get("SALESFORCE_CLIENT_ID")
-    redirect_uri = os.environ.get("SALESFORCE_REDIRECT_URI")
-
-    if not all([domain, client_id, redirect_uri]):
-        raise ValueError("Missing required environment variables.")
-
-    base_url = f"https://{domain}/services/oauth2/authorize"
-    query_params = {
-        "response_type": "code",
-        "client_id": client_id,
-        "redirect_uri": redirect_uri,
-        "scope": "api",
-        "state": f"profile:{profile_id}"
-    }
-
-    return f"{base_url}?{urllib.parse.urlencode(query_params)}"
+    return oauth_authorize_url(profile_id)
 
 
 @tool
-def execute_salesforce_soql(soql_query: str, profile_id: str) -> list[dict]:
+def execute_salesforce_soql(soql_query: str, profile_id: str) -> dict:
     """
     Executes a SOQL query against Salesforce using credentials fetched from DynamoDB.
 
@@ -65,48 +57,70 @@ def execute_salesforce_soql(soql_query: str, profile_id: str) -> list[dict]:
     Required environment variables:
         - SF_DDB_TABLE: Name of the DynamoDB table
         - SF_API_VERSION: Optional, defaults to 'v60.0'
+        - SOQL_MAX_ROWS / SOQL_MAX_BYTES: Optional, limits on returned rows
 
     Returns:
-        List[dict]: Records from the query result.
+        dict: Compact table of the query result:
+            - totalSize (int): Number of records matching the query.
+            - columns (list[str]): Field names; parent fields are dotted, e.g. "Account.Name".
+            - rows (list[list]): One list of values per record, in column order.
+            - truncated (bool): True if more records matched than were returned.
+              Narrow the query or use aggregates instead of paging through results.
 
     Raises:
         Exception: If credentials are missing or query fails.
     """
-    table_name = os.getenv("SF_DDB_TABLE")
+    key = ("soql", normalize_soql(soql_query))
+    cached = read_cache.get(profile_id, key)
+    if cached is not None:
+        return cached
+
+    # Pages are fetched lazily until the row/byte budget is reached
+    result = run_query(profile_id, soql_query)
+    read_cache.put(profile_id, key, result, soql_objects(soql_query))
+    return result
+
+async def aexecute_salesforce_soql(soql_query: str, profile_id: str) -> dict:
+    key = ("soql", normalize_soql(soql_query))
+    cached = read_cache.get(profile_id, key)
+    if cached is not None:
+        return cached
+
+    result = await arun_query(profile_id, soql_query)
+    read_cache.put(profile_id, key, result, soql_objects(soql_query))
+    return result
+
+execute_salesforce_soql.coroutine = aexecute_salesforce_soql
+
+def _rest_request(object_type, operation, data, record_id):
+    """Returns (method, path, request kwargs) for an execute_salesforce_rest call."""
     api_version = os.getenv("SF_API_VERSION", "v60.0")
 
-    if not table_name:
-        raise EnvironmentError("Missing SF_DDB_TABLE in environment variables.")
-
-    # Fetch credentials from DynamoDB
-    ddb = boto3.resource("dynamodb")
-    table = ddb.Table(table_name)
-
-    response = table.get_item(Key={"wa_id": profile_id})
-    if "Item" not in response:
-        raise Exception(f"No record found in DynamoDB for wa_id: {profile_id}")
-
-    item = response["Item"]
-    access_token = item.get("access_token")
-    instance_url = item.get("instance_url")
-
-    if not access_token or not instance_url:
-        raise Exception(f"Missing access_token or instance_url for wa_id: {profile_id}")
-
-    # Execute SOQL query
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    url = f"{instance_url}/services/data/{api_version}/query"
-    params = {"q": soql_query}
-
-    resp = requests.get(url, headers=headers, params=params)
+    if operation == "create":
+        return "POST", f"/services/data/{api_version}/sobjects/{object_type}/", {"json": data}
+    elif operation == "update":
+        if not record_id:
+            raise ValueError("record_id is required for update.")
+        return "PATCH", f"/services/data/{api_version}/sobjects/{object_type}/{record_id}", {"json": data}
+    elif operation == "get":
+        # If object_type is a known alias for user info, call the OAuth2 userinfo endpoint
+        if object_type == "userinfo":
+            return "GET", "/services/oauth2/userinfo", {}
+        return "GET", f"/services/data/{api_version}/{object_type}", {}
+    else:
+        raise ValueError(f"Unsupported operation: {operation}")
 
-    if resp.status_code != 200:
-        raise Exception(f"Salesforce query failed: {resp.status_code} - {resp.text}")
+def _rest_result(profile_id, object_type, operation, resp):
+    if resp.status_code not in (200, 201, 204):
+        raise Exception(f"Salesforce API failed: {resp.status_code} - {resp.text}")
 
-    return resp.json().get("records", [])
+    result = resp.json() if resp.content else {"success": True}
+    if operation == "get":
+        read_cache.put(profile_id, ("get", object_type.strip("/")), result, rest_path_objects(object_type))
+    else:
+        # Cached reads of this object are stale after a write
+        read_cache.invalidate(profile_id, object_type)
+    return result
 
 @tool
 def execute_salesforce_rest(
@@ -138,90 +152,123 @@ def execute_salesforce_rest(
     Raises:
         Exception: If credentials are missing or API request fails.
     """
-    table_name = os.getenv("SF_DDB_TABLE")
-    api_version = os.getenv("SF_API_VERSION", "v60.0")
+    if operation == "get":
+        cached = read_cache.get(profile_id, ("get", object_type.strip("/")))
+        if cached is not None:
+            return cached
 
-    if not table_name:
-        raise EnvironmentError("Missing SF_DDB_TABLE env variable.")
+    method, path, kwargs = _rest_request(object_type, operation, data, record_id)
+    resp = sf_request(profile_id, method, path, **kwargs)
+    return _rest_result(profile_id, object_type, operation, resp)
 
-    ddb = boto3.resource("dynamodb")
-    table = ddb.Table(table_name)
-    response = table.get_item(Key={"wa_id": str(profile_id)})
+async def aexecute_salesforce_rest(
+    object_type: str,
+    operation: Literal["create", "update", "get"],
+    profile_id: str,
+    data: dict = None,
+    record_id: Optional[str] = None
+) -> dict:
+    if operation == "get":
+        cached = read_cache.get(profile_id, ("get", object_type.strip("/")))
+        if cached is not None:
+            return cached
 
-    if "Item" not in response:
-        raise Exception(f"No record found for wa_id: {profile_id}")
+    method, path, kwargs = _rest_request(object_type, operation, data, record_id)
+    resp = await asf_request(profile_id, method, path, **kwargs)
+    return _rest_result(profile_id, object_type, operation, resp)
 
-    item = response["Item"]
-    access_token = item.get("access_token")
-    instance_url = item.get("instance_url")
+execute_salesforce_rest.coroutine = aexecute_salesforce_rest
 
-    if not access_token or not instance_url:
-        raise Exception("Missing access_token or instance_url")
+@tool
+def execute_salesforce_composite(operations: list[dict], profile_id: str, all_or_none: bool = False) -> list[dict]:
+    """
+    Runs several Salesforce create, update, or get operations in one tool call.
+    Prefer this over repeated execute_salesforce_rest calls when acting on multiple records.
 
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    Args:
+        operations (list[dict]): Operations to run, each with:
+            - operation (str): One of "create", "update", or "get".
+            - object_type (str): Object name for "create"/"update" (e.g., "Opportunity"),
+              or REST path relative to `/services/data/<version>/` for "get".
+            - record_id (str, optional): Required for "update".
+            - data (dict, optional): Field values for "create"/"update".
+            - reference_id (str, optional): Name for this operation's result. Later operations
+              can use "@{<reference_id>.id}" in their data or record_id to refer to a record
+              created earlier in the same call (e.g., create an Account, then its Contact).
+        profile_id (str): wa_id used to retrieve Salesforce credentials from DynamoDB.
+        all_or_none (bool): If true, roll back all changes when any operation fails.
+            Limited to 25 operations, or 200 when all are creates or all are updates.
 
-    if operation == "create":
-        url = f"{instance_url}/services/data/{api_version}/sobjects/{object_type}/"
-        resp = requests.post(url, headers=headers, json=data)
+    Returns:
+        list[dict]: One result per operation, in input order, with "index", "reference_id",
+        "success", and "id" (create/update), "body" (get), or "errors" (failure).
 
-    elif operation == "update":
-        if not record_id:
-            raise ValueError("record_id is required for update.")
-        url = f"{instance_url}/services/data/{api_version}/sobjects/{object_type}/{record_id}"
-        resp = requests.patch(url, headers=headers, json=data)
-    elif operation == "get":
-        # If object_type is a known alias for user info, call the OAuth2 userinfo endpoint
-        if object_type == "userinfo":
-            url = f"{instance_url}/services/oauth2/userinfo"
-        else:
-            url = f"{instance_url}/services/data/{api_version}/{object_type}"
-        resp = requests.get(url, headers=headers)
+    Raises:
+        ValueError: If an operation is invalid or all_or_none exceeds its limit.
+        Exception: If credentials are missing or the API request fails.
+    """
+    try:
+        return run_operations(profile_id, operations, all_or_none)
+    finally:
+        for op in operations:
+            if op.get("operation") in ("create", "update") and op.get("object_type"):
+                read_cache.invalidate(profile_id, op["object_type"])
 
-    else:
-        raise ValueError(f"Unsupported operation: {operation}")
 
-    if resp.status_code not in (200, 201, 204):
-        raise Exception(f"Salesforce API failed: {resp.status_code} - {resp.text}")
+@tool
+def describe_salesforce_object(object_type: str, profile_id: str, keywords: Optional[list[str]] = None) -> dict:
+    """
+    Returns field names, types and relationships of a Salesforce object, to write valid
+    SOQL or REST calls without guessing field names. Prefer this over fetching
+    "sobjects/<object>/describe" with execute_salesforce_rest.
 
-    return resp.json() if resp.content else {"success": True}
+    Args:
+        object_type (str): API name of the object (e.g., "Opportunity", "Invoice__c").
+        profile_id (str): wa_id used to retrieve Salesforce credentials from DynamoDB.
+        keywords (list[str], optional): Words to match against field and relationship
+            names or labels (e.g., ["stage", "amount", "account"]). Id and Name are always
+            returned. Without keywords, the first fields of the object are returned.
 
+    Returns:
+        dict: A compact schema with:
+            - object, label (str): Object API name and label.
+            - total_fields (int): Number of fields on the object.
+            - columns (list[str]): Names of the values in each fields row.
+            - fields (list[list]): [name, type, label, reference_to, relationship_name] per field.
+              Use relationship_name for parent fields in SOQL, e.g. "Account.Name".
+            - picklists (dict): Active values of returned picklist fields.
+            - child_relationships (list[list]): [relationship_name, child_object, field] for subqueries.
+            - truncated (bool): True if fields were cut off; pass keywords to narrow instead.
+
+    Raises:
+        Exception: If credentials are missing or the object does not exist.
+    """
+    return select_fields(schema_index.describe(profile_id, object_type), keywords)
+
+async def adescribe_salesforce_object(object_type: str, profile_id: str, keywords: Optional[list[str]] = None) -> dict:
+    return select_fields(await schema_index.adescribe(profile_id, object_type), keywords)
+
+describe_salesforce_object.coroutine = adescribe_salesforce_object
+
+
+def _delivery_key(config, tool_name, args):
+    """Idempotency key of this send; a redelivered event requesting it again reuses it."""
+    event_id = (config or {}).get("configurable", {}).get("event_id")
+    return idempotency_key(event_id, tool_name, args)
 
 @tool
-def send_whatsapp_message(recipient, message):
+def send_whatsapp_message(recipient, message, config: RunnableConfig = None):
     """
     Sends a WhatsApp message using the Meta API.
 
     :param recipient: The recipient's phone number.
-    :return: The JSON response from the API call.
+    :return: {"status": "queued", "delivery_id": ...}; the message is delivered in the background.
     """
-    access_token = get_secret("WhatsAppAPIToken")  # Fetch token from Secrets Manager
-    whatsapp_number_id = get_secret("WhatsappNumberID")  # Fetch WhatsApp number ID from Secrets Manager
-    if not access_token:
-        print("Failed to retrieve access token.")
-        return None
-    
-    url = f"https://graph.facebook.com/v22.0/{whatsapp_number_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": recipient,
-        "type": "text",
-        "text": {"body": message}
-    }
-    
-    response = requests.post(url, headers=headers, json=payload)
-    return response.json()
-
+    delivery_id = get_dispatcher().submit("whatsapp", {"to": recipient, "message": message}, _delivery_key(config, "send_whatsapp_message", [recipient, message]))
+    return {"status": "queued", "delivery_id": delivery_id}
 
 @tool
-def send_email_via_ses(email_json: str):
+def send_email_via_ses(email_json: str, config: RunnableConfig = None):
     """
     Sends an email using AWS SES.
 
@@ -251,23 +298,105 @@ def send_email_via_ses(email_json: str):
         if not to_email or not body:
             return "Error: Missing required fields ('to_email' or 'body')."
 
-        # Construct email body (HTML or plain text)
-        message_body = {"Html": {"Data": body}} if is_html else {"Text": {"Data": body}}
-        ses_client = boto3.client("ses")
-        FROM_EMAIL = os.getenv("EMAIL_FROM", "agent@mockify.com")
-        # Send email via AWS SES
-        response = ses_client.send_email(
-            Source=FROM_EMAIL,
-            Destination={"ToAddresses": [to_email]},
-            Message={
-                "Subject": {"Data": subject},
-                "Body": message_body,
-            },
-        )
-        return f"Email sent successfully! Message ID: {response['MessageId']}"
+        # Delivered in the background with a pooled SES client
+        payload = {"to_email": to_email, "subject": subject, "body": body, "is_html": is_html}
+        delivery_id = get_dispatcher().submit("email", payload, _delivery_key(config, "send_email_via_ses", payload))
+        return f"Email queued for delivery. Delivery ID: {delivery_id}"
 
     except Exception as e:
         return f"Error sending email: {str(e)}"
 
+# SES accepts raw messages up to 10 MB, and attachments grow by a third when base64-encoded
+BULK_ATTACHMENT_MAX_BYTES = int(os.getenv("BULK_ATTACHMENT_MAX_BYTES", 7 * 1024 * 1024))
+BULK_PREVIEW_ROWS = 20
+# Turn time kept back from the bulk job wait, for the model to report the result
+BULK_REPLY_RESERVE_SECONDS = 5
+
+def _gzip_spool(spool):
+    """Returns (compressed spooled file, size) for a spooled CSV, streaming rather than loading it."""
+    compressed = tempfile.SpooledTemporaryFile(max_size=BULK_ATTACHMENT_MAX_BYTES)
+    with gzip.GzipFile(fileobj=compressed, mode="wb") as gz:
+        shutil.copyfileobj(spool, gz)
+    size = compressed.tell()
+    compressed.seek(0)
+    return compressed, size
+
+@tool
+def export_salesforce_query_by_email(soql_query: str, profile_id: str, to_email: str, subject: str = "Salesforce export", config: RunnableConfig = None) -> dict:
+    """
+    Exports all records of a SOQL query as a CSV email attachment, using the Salesforce
+    Bulk API. Use this when the user asks for a full list or report by email, instead of
+    reading the records with execute_salesforce_soql. Records are not returned to you.
+
+    Args:
+        soql_query (str): The SOQL query to export. Relationship fields like Account.Name are allowed.
+        profile_id (str): wa_id used to retrieve Salesforce credentials from DynamoDB.
+        to_email (str): Recipient email address.
+        subject (str): Email subject.
+
+    Returns:
+        dict: A job summary with:
+            - job_id, state (str): Bulk job id and final state (JobComplete, Failed, Aborted).
+              A job that does not finish within the turn is aborted.
+            - records (int): Number of exported records.
+            - columns (list[str]): CSV columns.
+            - delivered_as (str): "attachment", "compressed_attachment" (.csv.gz), or
+              "summary" when the result was too large to attach; the email then has a preview.
+            - delivery_id (str): Id of the queued email; it is delivered in the background.
+            - error (str): Present if the job failed or did not finish; nothing was emailed.
+
+    Raises:
+        Exception: If credentials are missing or a Bulk API request fails.
+    """
+    timeout = BULK_JOB_TIMEOUT_SECONDS
+    budget = (config or {}).get("configurable", {}).get("turn_budget")
+    if budget and budget.remaining_seconds() is not None:
+        timeout = max(0, min(timeout, budget.remaining_seconds() - BULK_REPLY_RESERVE_SECONDS))
+
+    job, spool, size = export_query(profile_id, soql_query, timeout)
+    with spool:
+        summary = {"job_id": job["id"], "state": job["state"], "records": job.get("numberRecordsProcessed", 0)}
+        if job.get("timed_out"):
+            summary["error"] = f"Bulk query job did not finish within {timeout:.0f}s and was aborted; nothing was emailed. Try a narrower query."
+            return summary
+        if job["state"] != "JobComplete":
+            summary["error"] = job.get("errorMessage") or f"Bulk query job ended as {job['state']}"
+            return summary
+
+        preview = [spool.readline().decode("utf-8").rstrip("\r\n") for _ in range(BULK_PREVIEW_ROWS + 1)]
+        preview = [line for line in preview if line]
+        summary["columns"] = preview[0].replace('"', "").split(",") if preview else []
+        spool.seek(0)
+
+        body = f"{summary['records']} records exported from Salesforce.\n\nQuery: {soql_query}\n"
+        filename = "salesforce_export.csv"
+        if size <= BULK_ATTACHMENT_MAX_BYTES:
+            summary["delivered_as"] = "attachment"
+            attachment = (filename, spool.read())
+        else:
+            compressed, compressed_size = _gzip_spool(spool)
+            with compressed:
+                if compressed_size <= BULK_ATTACHMENT_MAX_BYTES:
+                    summary["delivered_as"] = "compressed_attachment"
+                    attachment = (filename + ".gz", compressed.read())
+                else:
+                    summary["delivered_as"] = "summary"
+                    attachment = None
+                    body += (
+                        f"\nThe result ({size // (1024 * 1024)} MB) is too large to attach; "
+                        f"narrow the query for a full export. First {len(preview) - 1} rows:\n\n" + "\n".join(preview)
+                    )
+
+        payload = {"to_email": to_email, "subject": subject, "body": body, "attachment": attachment}
+        summary["delivery_id"] = get_dispatcher().submit("raw_email", payload, _delivery_key(config, "export_salesforce_query_by_email", [soql_query, to_email, subject]))
+        return summary
+
+async def aexport_salesforce_query_by_email(soql_query: str, profile_id: str, to_email: str, subject: str = "Salesforce export", config: RunnableConfig = None) -> dict:
+    # Polling and streaming are blocking, so the export runs in a worker thread
+    return await asyncio.to_thread(export_salesforce_query_by_email.func, soql_query, profile_id, to_email, subject, config)
+
+export_salesforce_query_by_email.coroutine = aexport_salesforce_query_by_email
+
+
 
-tool_list = [generate_salesforce_oauth_url, execute_salesforce_soql,execute_salesforce_rest]
+tool_list = [generate_salesforce_oauth_url, execute_salesforce_soql,execute_salesforce_rest, execute_salesforce_composite, describe_salesforce_object, export_salesforce_query_by_email]
@@ -0,0 +1,161 @@
+# tracing.py
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of invocations whose spans are emitted as metrics
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 1.0))
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "SFAgent")
+
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "total_tokens")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def debug(*args):
+    """Prints only when LOG_LEVEL=DEBUG; use for full event and state dumps."""
+    if LOG_LEVEL == "DEBUG":
+        print(*args)
+
+
+class Trace:
+    """Spans and token usage recorded during one invocation."""
+
+    def __init__(self, name, dimensions):
+        self.name = name
+        self.dimensions = dimensions
+        self.spans = []
+        self.tokens = dict.fromkeys(TOKEN_FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration_ms, attrs):
+        with self._lock:
+            self.spans.append(dict(attrs, stage=stage, ms=round(duration_ms, 2)))
+
+    def add_tokens(self, usage):
+        with self._lock:
+            for field in TOKEN_FIELDS:
+                self.tokens[field] += int(usage.get(field) or 0)
+
+    def to_emf(self):
+        """Builds a CloudWatch Embedded Metric Format record with one metric per stage."""
+        durations = {}
+        for span in self.spans:
+            durations.setdefault(f"{span['stage']}.ms", []).append(span["ms"])
+
+        metrics = [{"Name": name, "Unit": "Milliseconds"} for name in durations]
+        metrics += [{"Name": field, "Unit": "Count"} for field in TOKEN_FIELDS]
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [list(self.dimensions)],
+                    "Metrics": metrics,
+                }],
+            },
+            "trace": self.name,
+            "spans": self.spans,
+        }
+        record.update(self.dimensions)
+        record.update(durations)
+        record.update(self.tokens)
+        return record
+
+
+@contextmanager
+def start_trace(name, **dimensions):
+    """Collects spans for the enclosed work and prints them as an EMF log line if sampled."""
+    if random.random() >= METRICS_SAMPLE_RATE:
+        yield None
+        return
+
+    trace = Trace(name, dimensions)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        print(json.dumps(trace.to_emf(), default=str))
+
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Times the enclosed block as a stage of the current trace. The yielded dict can be
+    updated with attributes known only at the end, such as HTTP status or bytes.
+    """
+    trace = _current.get()
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        if trace is not None:
+            trace.record(stage, (time.perf_counter() - started) * 1000, attrs)
+
+
+def add_tokens(usage):
+    """Adds a model response's usage_metadata to the current trace."""
+    trace = _current.get()
+    if trace is not None and usage:
+        trace.add_tokens(usage)
+
+
+def emit_metrics(name, metrics, **dimensions):
+    """
+    Prints an EMF log line for metrics recorded outside an invocation trace, such as
+    background deliveries. metrics maps a name to (unit, value or list of values).
+    """
+    if not metrics:
+        return
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": metric, "Unit": unit} for metric, (unit, _) in metrics.items()],
+            }],
+        },
+        "trace": name,
+    }
+    record.update(dimensions)
+    record.update({metric: value for metric, (_, value) in metrics.items()})
+    print(json.dumps(record, default=str))
+
+
+class ToolSpanCallback(BaseCallbackHandler):
+    """Records a span per tool call, including tools served over MCP."""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._started = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._started[run_id] = ((serialized or {}).get("name") or kwargs.get("name"), time.perf_counter())
+
+    def _finish(self, run_id, status):
+        name, started = self._started.pop(run_id, (None, None))
+        if started is not None:
+            self.trace.record("tool", (time.perf_counter() - started) * 1000, {"tool": name, "status": status})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id, "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "error")
+
+
+def callbacks():
+    """Callbacks to pass in the graph config so tool calls join the current trace."""
+    trace = _current.get()
+    return [ToolSpanCallback(trace)] if trace is not None else []
@@ -0,0 +1,96 @@
+# turn_budget.py
+import os
+import json
+import time
+import threading
+
+# Limits for one agent turn; 0 disables a limit
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", 8))
+# Should leave room within the Lambda timeout for the checkpoint write and the reply
+AGENT_TURN_DEADLINE_SECONDS = float(os.getenv("AGENT_TURN_DEADLINE_SECONDS", 45))
+# Counts tokens the turn adds (outputs and input growth between calls), not the resent history
+AGENT_TURN_MAX_TOKENS = int(os.getenv("AGENT_TURN_MAX_TOKENS", 60000))
+
+EXHAUSTED_MESSAGE = (
+    "Sorry, I could not finish this request within my limits. "
+    "Please try again, or ask for something more specific."
+)
+REPEATED_CALL_NOTE = "[Repeated call: this is the result of the identical earlier call in this turn]\n"
+
+
+class TurnBudget:
+    """
+    Step, time and token limits for one agent turn, plus a memo of the turn's tool results.
+
+    Passed to the graph as config["configurable"]["turn_budget"].
+    """
+
+    def __init__(self, max_steps=AGENT_MAX_STEPS, deadline_seconds=AGENT_TURN_DEADLINE_SECONDS, max_tokens=AGENT_TURN_MAX_TOKENS):
+        self.max_steps = max_steps
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        self.steps = 0
+        self.tokens = 0
+        self.memo_hits = 0
+        self._base_input_tokens = None
+        self._tool_results = {}
+        self._lock = threading.Lock()
+
+    def remaining_seconds(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def exhausted(self):
+        """Returns why the turn must stop ("steps", "deadline" or "tokens"), or None."""
+        if self.max_steps and self.steps >= self.max_steps:
+            return "steps"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "deadline"
+        if self.max_tokens and self.tokens >= self.max_tokens:
+            return "tokens"
+        return None
+
+    def add_step(self):
+        self.steps += 1
+
+    def add_tokens(self, usage):
+        """
+        Charges a model call's output tokens plus its input beyond the largest input seen
+        so far. Each call resends the whole history, so charging total_tokens would count
+        it again on every step. The first call sets the baseline: history from earlier
+        turns is bounded by pruning, not by this budget.
+        """
+        if usage:
+            input_tokens = int(usage.get("input_tokens") or 0)
+            with self._lock:
+                if self._base_input_tokens is None:
+                    self._base_input_tokens = input_tokens
+                self.tokens += int(usage.get("output_tokens") or 0) + max(0, input_tokens - self._base_input_tokens)
+                self._base_input_tokens = max(self._base_input_tokens, input_tokens)
+
+    def final_response(self, reason):
+        """The {"nextagent", "message"} reply used when the turn runs out of budget."""
+        print(f"Turn budget exhausted ({reason}): steps={self.steps}, tokens={self.tokens}")
+        return json.dumps({"nextagent": "comms-agent", "message": EXHAUSTED_MESSAGE})
+
+    @staticmethod
+    def _tool_key(tool_call):
+        return tool_call["name"], json.dumps(tool_call["args"], sort_keys=True, default=str)
+
+    def cached_tool_result(self, tool_call):
+        """Returns the ToolMessage of an identical earlier call in this turn, or None."""
+        with self._lock:
+            return self._tool_results.get(self._tool_key(tool_call))
+
+    def remember_tool_result(self, tool_call, message):
+        with self._lock:
+            self._tool_results.setdefault(self._tool_key(tool_call), message)
+
+
+def repeated_result(tool_call, message):
+    """Answers a repeated tool call with the earlier call's result."""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+    return message.model_copy(update={
+        "content": REPEATED_CALL_NOTE + content,
+        "tool_call_id": tool_call["id"],
+        "id": None,
+    })
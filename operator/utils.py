@@ -1,19 +1,42 @@
+import os
+import time
+import contextvars
 import boto3
+from concurrent.futures import ThreadPoolExecutor
+from tracing import span
 
 # Initialize AWS resources
 dynamodb = boto3.resource("dynamodb", region_name="ap-south-1")  # Change region if needed
 table = dynamodb.Table("UserProfiles")
 
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", 300))
+# Unknown senders are cached for a shorter time so newly registered users are picked up
+PROFILE_NEGATIVE_TTL_SECONDS = int(os.getenv("PROFILE_NEGATIVE_TTL_SECONDS", 60))
+
+_profile_cache = {}
+_profile_executor = ThreadPoolExecutor(max_workers=8)
+
+SECRET_CACHE_TTL_SECONDS = int(os.getenv("SECRET_CACHE_TTL_SECONDS", 300))
+
+_secrets_client = None
+_secret_cache = {}
+
 def get_secret(secret_name):
     """
-    Fetches the WhatsApp API token from AWS Secrets Manager.
+    Fetches a secret string from AWS Secrets Manager, cached for SECRET_CACHE_TTL_SECONDS.
     """
-    client = boto3.client("secretsmanager")
-    
+    global _secrets_client
+    cached = _secret_cache.get(secret_name)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
     try:
-        response = client.get_secret_value(SecretId=secret_name)
-        secret_data = response["SecretString"]
-        return str(secret_data)
+        if _secrets_client is None:
+            _secrets_client = boto3.client("secretsmanager")
+        response = _secrets_client.get_secret_value(SecretId=secret_name)
+        secret_data = str(response["SecretString"])
+        _secret_cache[secret_name] = (time.monotonic() + SECRET_CACHE_TTL_SECONDS, secret_data)
+        return secret_data
     except Exception as e:
         print(f"Error fetching secret: {e}")
         return None
@@ -37,4 +60,36 @@ def get_all_userids_and_channels(profile_id):
     items = response.get("Items", [])
     return [(item["userid"], item["channel"]) for item in items]
 
+def resolve_profile(userid):
+    """
+    Returns (profile_id, [(userid, channel), ...]) for a sender, or None if unknown.
+    Results, including unknown senders, are cached in-process under every linked userid.
+    """
+    cached = _profile_cache.get(userid)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    with span("profile_lookup"):
+        profile_id = get_profile_id(userid)
+        if not profile_id:
+            _profile_cache[userid] = (time.monotonic() + PROFILE_NEGATIVE_TTL_SECONDS, None)
+            return None
+
+        profile = (profile_id, get_all_userids_and_channels(profile_id))
+    expires_at = time.monotonic() + PROFILE_CACHE_TTL_SECONDS
+    _profile_cache[userid] = (expires_at, profile)
+    for uid, _ in profile[1]:
+        _profile_cache[uid] = (expires_at, profile)
+    return profile
+
+def resolve_profiles(userids):
+    """
+    Resolves many senders at once, e.g. for an SQS batch. Uncached senders are
+    queried in parallel, since the UserIdIndex GSI cannot be read with BatchGetItem.
+    Returns a dict of userid -> resolve_profile() result.
+    """
+    unique = list(dict.fromkeys(userids))
+    # Pool threads do not inherit contextvars; without a copy the lookups' trace spans are lost
+    futures = [_profile_executor.submit(contextvars.copy_context().run, resolve_profile, userid) for userid in unique]
+    return {userid: future.result() for userid, future in zip(unique, futures)}
 
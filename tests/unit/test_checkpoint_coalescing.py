@@ -0,0 +1,147 @@
+import os
+import sys
+from typing import TypedDict
+from unittest import mock
+
+import pytest
+from boto3.dynamodb.conditions import ConditionBase
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "operator"))
+
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.graph import StateGraph, START, END
+from langgraph_dynamodb_checkpoint import DynamoDBSaver
+from checkpoint_coalescing import ZLIB_PREFIX, coalescing_saver
+
+
+class StubTable:
+    """Keeps items by (PK, SK) and answers the saver's PK queries and begins_with filters."""
+
+    def __init__(self):
+        self.items = {}
+        self.puts = []
+
+    def put_item(self, Item, **kwargs):
+        self.puts.append(Item)
+        self.items[(Item["PK"], Item["SK"])] = dict(Item)
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get((Key["PK"], Key["SK"]))
+        return {"Item": dict(item)} if item else {}
+
+    def query(self, KeyConditionExpression, FilterExpression=None, ScanIndexForward=True, **kwargs):
+        assert isinstance(KeyConditionExpression, ConditionBase)
+        _, pk = KeyConditionExpression.get_expression()["values"]
+        items = sorted((item for (item_pk, _), item in self.items.items() if item_pk == pk), key=lambda i: i["SK"])
+        if FilterExpression is not None:
+            expression = FilterExpression.get_expression()
+            assert expression["operator"] == "begins_with"
+            attr, prefix = expression["values"]
+            items = [item for item in items if item.get(attr.name, "").startswith(prefix)]
+        return {"Items": items[::-1] if not ScanIndexForward else items}
+
+    def checkpoint_puts(self):
+        return [item for item in self.puts if "checkpoint" in item]
+
+
+@pytest.fixture
+def stored():
+    """A coalescing saver over a real DynamoDBSaver, with the DynamoDBSaver and its stub table."""
+    table = StubTable()
+    with mock.patch.object(DynamoDBSaver, "_get_or_create_table", return_value=table):
+        inner = DynamoDBSaver("whatsapp_checkpoint")
+    return coalescing_saver(inner), inner, table
+
+
+class State(TypedDict):
+    steps: list
+
+
+def build_graph(saver, fail_at=None):
+    def step(name):
+        def node(state):
+            if name == fail_at:
+                raise RuntimeError(f"{name} failed")
+            return {"steps": state["steps"] + [name]}
+        return node
+
+    graph = StateGraph(State)
+    graph.add_node("first", step("first"))
+    graph.add_node("second", step("second"))
+    graph.add_edge(START, "first")
+    graph.add_edge("first", "second")
+    graph.add_edge("second", END)
+    return graph.compile(checkpointer=saver)
+
+
+def test_checkpoints_are_stored_compressed_and_read_back(stored):
+    saver, inner, table = stored
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": ["x" * 5000]}
+    config = {"configurable": {"thread_id": "thread-1", "checkpoint_ns": ""}}
+    inner.put(config, checkpoint, {"source": "input", "step": 0}, {})
+
+    [item] = table.items.values()
+    assert item["type"].startswith(ZLIB_PREFIX)
+    assert len(item["checkpoint"]) < 5000
+
+    loaded = saver.get_tuple({"configurable": {"thread_id": "thread-1"}})
+    assert loaded.checkpoint["channel_values"] == {"messages": ["x" * 5000]}
+
+
+def test_turn_is_written_once_on_flush(stored):
+    saver, inner, table = stored
+    config = {"configurable": {"thread_id": "thread-1"}}
+    app = build_graph(saver)
+
+    assert app.invoke({"steps": []}, config) == {"steps": ["first", "second"]}
+    assert table.puts == []
+
+    saver.flush(config)
+    assert len(table.checkpoint_puts()) == 1
+    assert inner.get_tuple(config).checkpoint["channel_values"]["steps"] == ["first", "second"]
+
+    # The next turn starts from the stored checkpoint
+    assert app.invoke({"steps": ["again"]}, config) == {"steps": ["again", "first", "second"]}
+
+
+def test_get_tuple_is_served_from_the_buffer(stored):
+    saver, _, table = stored
+    config = {"configurable": {"thread_id": "thread-1", "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    saved_config = saver.put(config, checkpoint, {"source": "input", "step": 0}, {})
+
+    with mock.patch.object(table, "query", side_effect=AssertionError("read from DynamoDB")):
+        assert saver.get_tuple({"configurable": {"thread_id": "thread-1"}}).checkpoint["id"] == checkpoint["id"]
+        assert saver.get_tuple(saved_config).config == saved_config
+
+
+def test_pending_writes_are_kept_and_flushed(stored):
+    saver, inner, _ = stored
+    config = {"configurable": {"thread_id": "thread-1", "checkpoint_ns": ""}}
+    saved_config = saver.put(config, empty_checkpoint(), {"source": "loop", "step": 1}, {})
+    saver.put_writes(saved_config, [("steps", ["pending"])], "task-1")
+
+    assert saver.get_tuple(saved_config).pending_writes == [("task-1", "steps", ["pending"])]
+
+    saver.flush(config)
+    assert inner.get_tuple(saved_config).pending_writes == [("task-1", "steps", ["pending"])]
+
+
+def test_flush_after_failed_invoke_keeps_progress(stored):
+    saver, inner, table = stored
+    config = {"configurable": {"thread_id": "thread-1"}}
+
+    with pytest.raises(RuntimeError):
+        try:
+            build_graph(saver, fail_at="second").invoke({"steps": []}, config)
+        finally:
+            saver.flush(config)
+
+    assert len(table.checkpoint_puts()) == 1
+    state = inner.get_tuple(config)
+    assert state.checkpoint["channel_values"]["steps"] == ["first"]
+
+    # Resuming from the stored checkpoint runs only the step that failed
+    assert build_graph(saver).invoke(None, config) == {"steps": ["first", "second"]}